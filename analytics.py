@@ -4,8 +4,81 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+# strings em buffer Arrow (kernels vetorizados, sem objeto Python por célula);
+# sem pyarrow, cai no StringDtype padrão
+try:
+    import pyarrow as pa
+    STR_DTYPE = "string[pyarrow]"
+except Exception:
+    pa = None  # type: ignore
+    STR_DTYPE = "string"
+
+BASE_COLS = [
+    "ts_utc", "origin", "destination", "departure_date", "return_date",
+    "adults", "children", "cabin", "currency", "direct_only",
+    "best_price", "best_airline", "best_stops", "offers_count",
+    "provider", "run_id", "extra",
+]
+STR_COLS = ["origin", "destination", "cabin", "currency", "best_airline", "provider", "run_id"]
+CATEGORY_COLS = ["origin", "destination", "cabin", "currency", "best_airline", "provider"]
+
+
+_TRUE_STR = ["true", "t", "1", "yes", "y", "sim"]
+_FALSE_STR = ["false", "f", "0", "no", "n", "não", "nao"]
+
+
+def _to_bool_series(s: pd.Series) -> pd.Series:
+    """
+    Coluna mista (bool/número/texto) -> boolean nullable, vetorizado:
+    números (int/float/bool) valem bool(v); texto só pelas listas _TRUE_STR/_FALSE_STR
+    (normalizado 1x e comparado por isin); o resto vira <NA>.
+    """
+    if pd.api.types.is_bool_dtype(s):
+        return s.astype("boolean")
+    is_str = s.map(lambda v: isinstance(v, str)).astype(bool)
+    is_num = s.map(lambda v: isinstance(v, (int, float))).astype(bool)
+    # to_numeric só nos números de verdade: "2"/"0.0"/"inf" em texto não viram bool
+    num = pd.to_numeric(s.where(is_num), errors="coerce")
+    out = (num != 0).astype("boolean").mask(num.isna())
+    txt = s.where(is_str).astype("string").str.strip().str.lower()
+    out = out.mask(txt.isin(_TRUE_STR).fillna(False).astype(bool), True)
+    out = out.mask(txt.isin(_FALSE_STR).fillna(False).astype(bool), False)
+    return out
+
+
+def _parse_day(s: pd.Series) -> pd.Series:
+    """
+    Datas de viagem -> datetime64 no dia.
+    Poucas datas distintas se repetem em milhares de linhas: parseia só os valores
+    únicos (factorize) com format="ISO8601" e espalha pelos códigos.
+    """
+    codes, uniques = pd.factorize(s)
+    parsed = pd.DatetimeIndex(
+        pd.to_datetime(pd.Index(uniques, dtype=object), format="ISO8601", errors="coerce")
+    ).floor("D")
+    # código -1 (nulo) vira NaT
+    values = parsed.take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(values, index=s.index, name=s.name)
+
+
+def _parse_ts_utc(s: pd.Series) -> pd.Series:
+    """
+    ISO-8601 -> datetime UTC.
+    Caminho rápido: cast string->timestamp do Arrow na coluna inteira (sem objeto por linha).
+    Se algum valor não for ISO completo, o Arrow recusa a coluna toda e caímos no
+    pd.to_datetime (formato ISO8601 fixo, inválidos viram NaT).
+    """
+    if pa is not None:
+        try:
+            arr = pa.array(s.astype("string"), from_pandas=True).cast(pa.timestamp("us", tz="UTC"))
+            return pd.Series(arr.to_pandas(), index=s.index, name=s.name)
+        except Exception:
+            pass
+    return pd.to_datetime(s, format="ISO8601", errors="coerce", utc=True)
+
 
 def to_dataframe(records: list[dict]) -> pd.DataFrame:
     """
@@ -22,22 +95,19 @@ def to_dataframe(records: list[dict]) -> pd.DataFrame:
 
     df = pd.DataFrame.from_records(records)
 
-    # Garantir colunas básicas (evita KeyError quando algum registro antigo não tiver)
-    for col in [
-        "ts_utc", "origin", "destination", "departure_date", "return_date",
-        "adults", "children", "cabin", "currency", "direct_only",
-        "best_price", "best_airline", "best_stops", "offers_count",
-        "provider", "run_id", "extra"
-    ]:
-        if col not in df.columns:
-            df[col] = pd.NA
+    # Garantir colunas básicas (evita KeyError quando algum registro antigo não tiver);
+    # um único reindex em vez de inserir coluna por coluna
+    missing = [c for c in BASE_COLS if c not in df.columns]
+    if missing:
+        df = df.reindex(columns=[*df.columns, *missing])
 
     # Tipos
-    df["ts_utc"] = pd.to_datetime(df["ts_utc"], errors="coerce", utc=True)
+    df["ts_utc"] = _parse_ts_utc(df["ts_utc"])
 
-    # datas (date) — se vierem como string "YYYY-MM-DD"
-    df["departure_date"] = pd.to_datetime(df["departure_date"], errors="coerce").dt.date
-    df["return_date"] = pd.to_datetime(df["return_date"], errors="coerce").dt.date
+    # datas — se vierem como string "YYYY-MM-DD"; ficam datetime64 truncado no dia
+    # (floor("D") em int64, sem criar um objeto date Python por linha)
+    df["departure_date"] = _parse_day(df["departure_date"])
+    df["return_date"] = _parse_day(df["return_date"])
 
     # numéricos
     for col in ["adults", "children", "offers_count", "best_stops"]:
@@ -45,28 +115,26 @@ def to_dataframe(records: list[dict]) -> pd.DataFrame:
 
     df["best_price"] = pd.to_numeric(df["best_price"], errors="coerce")
 
+    # textos: dtype string (Arrow) no lugar de object — filtros e groupby comparam direto
+    for col in STR_COLS:
+        df[col] = df[col].astype(STR_DTYPE)
+
     # boolean
     # (aceita True/False, "true"/"false", 0/1)
-    def _to_bool(v):
-        if pd.isna(v):
-            return pd.NA
-        if isinstance(v, bool):
-            return v
-        if isinstance(v, (int, float)):
-            return bool(v)
-        if isinstance(v, str):
-            s = v.strip().lower()
-            if s in ("true", "t", "1", "yes", "y", "sim"):
-                return True
-            if s in ("false", "f", "0", "no", "n", "não", "nao"):
-                return False
-        return pd.NA
-
-    df["direct_only"] = df["direct_only"].map(_to_bool).astype("boolean")
+    df["direct_only"] = _to_bool_series(df["direct_only"])
 
     # derivados
-    df["route"] = df["origin"].astype(str).fillna("") + "→" + df["destination"].astype(str).fillna("")
-    df.loc[df["origin"].isna() | df["destination"].isna(), "route"] = pd.NA
+    # códigos IATA normalizados uma vez (filtros comparam direto, sem .str.upper() por filtro)
+    for col in ("origin", "destination"):
+        df[col] = df[col].str.strip().str.upper()
+
+    # concatenação de strings propaga <NA> quando falta origem/destino;
+    # poucas rotas distintas -> category (groupby/filtro por código inteiro)
+    df["route"] = (df["origin"] + "→" + df["destination"]).astype("category")
+
+    # baixa cardinalidade: category (códigos int em vez de string por linha)
+    for col in CATEGORY_COLS:
+        df[col] = df[col].astype("category")
 
     return df
 
@@ -90,37 +158,38 @@ def apply_filters(
     if df is None or df.empty:
         return df
 
-    out = df.copy()
+    # uma única máscara booleana combinada (em vez de reindexar o frame a cada filtro)
+    mask = pd.Series(True, index=df.index)
 
-    if route and "route" in out.columns:
-        out = out[out["route"] == route]
+    if route and "route" in df.columns:
+        mask &= df["route"] == route
 
-    if airline and "best_airline" in out.columns:
-        out = out[out["best_airline"] == airline]
+    if airline and "best_airline" in df.columns:
+        mask &= df["best_airline"] == airline
 
-    if direct_only is not None and "direct_only" in out.columns:
-        out = out[out["direct_only"] == direct_only]
+    if direct_only is not None and "direct_only" in df.columns:
+        mask &= df["direct_only"] == direct_only
 
     # ts_utc window
-    if "ts_utc" in out.columns:
+    if "ts_utc" in df.columns:
         if date_from is not None:
             dfrom = pd.to_datetime(date_from, utc=True, errors="coerce")
             if not pd.isna(dfrom):
-                out = out[out["ts_utc"] >= dfrom]
+                mask &= df["ts_utc"] >= dfrom
         if date_to is not None:
             dto = pd.to_datetime(date_to, utc=True, errors="coerce")
             if not pd.isna(dto):
-                out = out[out["ts_utc"] <= dto]
+                mask &= df["ts_utc"] <= dto
 
-    # departure_date window (date)
-    if "departure_date" in out.columns and (dep_date_from is not None or dep_date_to is not None):
-        # converte datetime -> date
+    # departure_date window (dia)
+    if "departure_date" in df.columns and (dep_date_from is not None or dep_date_to is not None):
+        # trunca o limite no dia (departure_date já vem com floor("D"))
         if dep_date_from is not None:
-            out = out[out["departure_date"] >= pd.to_datetime(dep_date_from, errors="coerce").date()]
+            mask &= df["departure_date"] >= pd.to_datetime(dep_date_from, errors="coerce").floor("D")
         if dep_date_to is not None:
-            out = out[out["departure_date"] <= pd.to_datetime(dep_date_to, errors="coerce").date()]
+            mask &= df["departure_date"] <= pd.to_datetime(dep_date_to, errors="coerce").floor("D")
 
-    return out
+    return df.loc[mask.fillna(False).astype(bool)].copy()
 
 
 def summary_metrics(df: pd.DataFrame) -> Dict[str, object]:
@@ -140,26 +209,36 @@ def summary_metrics(df: pd.DataFrame) -> Dict[str, object]:
 
     rows = int(len(df))
 
-    price_series = df["best_price"].dropna() if "best_price" in df.columns else pd.Series(dtype=float)
-    best_min = float(price_series.min()) if len(price_series) else None
-    best_avg = float(price_series.mean()) if len(price_series) else None
-    best_max = float(price_series.max()) if len(price_series) else None
+    # preço e timestamp extraídos uma vez como arrays; todas as métricas saem deles
+    raw_prices = (
+        df["best_price"].to_numpy(dtype="float64", na_value=np.nan)
+        if "best_price" in df.columns else np.full(rows, np.nan)
+    )
+    has_price = ~np.isnan(raw_prices)
+    prices = raw_prices[has_price]
+    best_min = float(prices.min()) if prices.size else None
+    best_avg = float(prices.mean()) if prices.size else None
+    best_max = float(prices.max()) if prices.size else None
 
     last_seen = None
+    trend_pct = None
     if "ts_utc" in df.columns:
-        mx = df["ts_utc"].max()
+        ts = df["ts_utc"]
+        mx = ts.max()
         if not pd.isna(mx):
             # devolve datetime aware (UTC)
             last_seen = mx.to_pydatetime()
 
-    # tendência simples
-    trend_pct = None
-    if {"ts_utc", "best_price"}.issubset(df.columns):
-        dfx = df.dropna(subset=["ts_utc", "best_price"]).sort_values("ts_utc")
-        if len(dfx) >= 10:
-            n = max(2, int(len(dfx) * 0.2))
-            early = float(dfx["best_price"].head(n).mean())
-            late = float(dfx["best_price"].tail(n).mean())
+        # tendência simples (histórico append-only: só ordena se não vier em ordem)
+        keep = has_price & ts.notna().to_numpy()
+        if int(keep.sum()) >= 10:
+            p = raw_prices[keep]
+            ts_keep = ts[keep]
+            if not ts_keep.is_monotonic_increasing:
+                p = p[np.argsort(ts_keep.to_numpy(), kind="stable")]
+            n = max(2, int(len(p) * 0.2))
+            early = float(p[:n].mean())
+            late = float(p[-n:].mean())
             if early != 0:
                 trend_pct = (late - early) / early * 100.0
 
@@ -187,7 +266,7 @@ def group_views(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
         tmp = df.dropna(subset=["route", "best_price"])
         if not tmp.empty:
             by_route = (
-                tmp.groupby("route", as_index=False)
+                tmp.groupby("route", as_index=False, observed=True, sort=False)
                    .agg(
                        consultas=("best_price", "count"),
                        min_preco=("best_price", "min"),
@@ -202,7 +281,7 @@ def group_views(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
         tmp = df.dropna(subset=["best_airline", "best_price"])
         if not tmp.empty:
             by_airline = (
-                tmp.groupby("best_airline", as_index=False)
+                tmp.groupby("best_airline", as_index=False, observed=True, sort=False)
                    .agg(
                        consultas=("best_price", "count"),
                        min_preco=("best_price", "min"),
@@ -229,23 +308,20 @@ def price_timeseries(df: pd.DataFrame, freq: str = "D") -> pd.DataFrame:
     if not {"ts_utc", "best_price"}.issubset(df.columns):
         return pd.DataFrame()
 
-    dfx = df.dropna(subset=["ts_utc", "best_price"]).copy()
+    dfx = df.dropna(subset=["ts_utc", "best_price"])
     if dfx.empty:
         return pd.DataFrame()
 
-    dfx = dfx.sort_values("ts_utc")
-    dfx["bucket"] = dfx["ts_utc"].dt.floor(freq)
-
+    # resample binning em int64 no DatetimeIndex (sem ordenar nem criar coluna bucket)
     out = (
-        dfx.groupby("bucket", as_index=False)
-           .agg(
-               min_price=("best_price", "min"),
-               avg_price=("best_price", "mean"),
-               count=("best_price", "count"),
-           )
-           .sort_values("bucket")
+        dfx.set_index("ts_utc")["best_price"]
+           .resample(freq)
+           .agg(["min", "mean", "count"])
+           .rename(columns={"min": "min_price", "mean": "avg_price"})
     )
-    return out
+    out = out[out["count"] > 0]
+    out.index.name = "bucket"
+    return out.reset_index()
 
 
 def best_deals(df: pd.DataFrame, top_n: int = 10) -> pd.DataFrame:
@@ -255,7 +331,9 @@ def best_deals(df: pd.DataFrame, top_n: int = 10) -> pd.DataFrame:
     if df is None or df.empty or "best_price" not in df.columns:
         return pd.DataFrame()
 
-    dfx = df.dropna(subset=["best_price"]).copy()
+    # top-K por seleção parcial (nsmallest) em vez de ordenar o frame inteiro;
+    # keep="all" preserva os empates do corte para o desempate por ts_utc abaixo
+    dfx = df.dropna(subset=["best_price"]).nsmallest(int(top_n), "best_price", keep="all")
     if "ts_utc" in dfx.columns:
         dfx = dfx.sort_values(["best_price", "ts_utc"], ascending=[True, False])
     else:
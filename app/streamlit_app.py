@@ -1,12 +1,26 @@
 from __future__ import annotations
 
-import json
+import io
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
 import streamlit as st
 
+from utilitario.history_core import (
+    HistoryTail,
+    best_offers_frame,
+    build_offers_table,
+    count_lines,
+    filter_history,
+    list_dir_files,
+    money_series,
+    newest_first,
+    read_json,
+    safe_int,
+    tail_lines,
+)
 
 # -----------------------------
 # Paths
@@ -21,116 +35,85 @@ HISTORY_FILE = DATA_DIR / "history.jsonl"
 
 
 # -----------------------------
-# Helpers
+# Cache (Streamlit)
 # -----------------------------
-def read_json(path: Path, default: Any) -> Any:
-    try:
-        if not path.exists():
-            return default
-        txt = path.read_text(encoding="utf-8").strip()
-        if not txt:
-            return default
-        return json.loads(txt)
-    except Exception:
-        return default
-
-
-def read_jsonl(path: Path) -> pd.DataFrame:
-    if not path.exists():
-        return pd.DataFrame()
-
-    rows: List[Dict[str, Any]] = []
-    try:
-        with path.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    rows.append(json.loads(line))
-                except Exception:
-                    continue
-    except Exception:
-        return pd.DataFrame()
-
-    if not rows:
-        return pd.DataFrame()
-
-    return pd.json_normalize(rows)
-
-
-def money(x: Any) -> str:
-    try:
-        if x is None:
-            return "-"
-        v = float(x)
-        return f"R$ {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except Exception:
-        return "-"
-
-
-def safe_int(x: Any, default: int = 0) -> int:
-    try:
-        return int(x)
-    except Exception:
-        return default
-
-
-def offer_price_from_history_row(row: Dict[str, Any]) -> Optional[float]:
-    """
-    Tenta extrair preço da linha do history.jsonl.
-    Você salva a offer crua, então aqui tentamos o padrão do Amadeus: offer.price.grandTotal.
-    """
-    try:
-        p = row.get("offer.price.grandTotal")
-        if p is not None:
-            return float(p)
-    except Exception:
-        pass
-    try:
-        p = row.get("offer.price.total")
-        if p is not None:
-            return float(p)
-    except Exception:
-        pass
-    return None
-
-
-def carrier_from_offer(row: Dict[str, Any]) -> str:
-    # Amadeus: validatingAirlineCodes[0]
-    try:
-        vac = row.get("offer.validatingAirlineCodes")
-        if isinstance(vac, list) and vac:
-            return str(vac[0])
-        if isinstance(vac, str) and vac:
-            return vac
-    except Exception:
-        pass
-    return "?"
-
-
-def stops_from_offer(row: Dict[str, Any]) -> Optional[int]:
-    # tenta inferir stops: itineraries[0].segments length - 1
-    try:
-        itins = row.get("offer.itineraries")
-        if isinstance(itins, list) and itins:
-            segs = itins[0].get("segments", [])
-            if isinstance(segs, list):
-                return max(0, len(segs) - 1)
-    except Exception:
-        pass
-    return None
-
-
-def dedupe_offers_table(df: pd.DataFrame) -> pd.DataFrame:
+@st.cache_resource(show_spinner=False)
+def get_history_tail(path: str) -> HistoryTail:
+    return HistoryTail(Path(path))
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def history_facets(history_version: int, _history: pd.DataFrame) -> Dict[Optional[str], List[str]]:
     """
-    Remove duplicatas comuns quando MAX_RESULTS=10 traz muitos resultados idênticos
-    (ou quando a UI repete).
+    run_id -> route_keys (ordenados), mais None -> todas as rotas.
+    Calculado uma vez por versão do histórico; a sidebar não varre o frame a cada rerun.
     """
-    cols = [c for c in ["run_id", "route_key", "departure_date", "return_date", "offer.id", "offer.price.grandTotal"] if c in df.columns]
-    if cols:
-        return df.drop_duplicates(subset=cols, keep="first")
-    return df.drop_duplicates(keep="first")
+    if _history.empty:
+        return {}
+    has_routes = "route_key" in _history.columns
+    out: Dict[Optional[str], List[str]] = {
+        None: sorted(_history["route_key"].dropna().unique().tolist()) if has_routes else []
+    }
+    if "run_id" in _history.columns:
+        for rid in _history["run_id"].dropna().unique().tolist():
+            out[str(rid)] = []
+        if has_routes:
+            pairs = _history[["run_id", "route_key"]].dropna().drop_duplicates()
+            for rid, routes in pairs.groupby("run_id", sort=False)["route_key"]:
+                out[str(rid)] = sorted(routes.tolist())
+    return out
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_json(path: str, version: Tuple[int, int]) -> Any:
+    # version = (mtime_ns, size): o arquivo só é relido/parseado quando muda
+    return read_json(Path(path), {})
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def cached_best_view(version: Tuple[int, int], _best: Dict[str, Any]) -> Tuple[pd.DataFrame, List[str]]:
+    # version = (mtime_ns, size) do best_offers.json: tabela e opções de destino só são
+    # remontadas quando o arquivo muda (o fragment não varre o frame a cada troca de filtro)
+    df = best_offers_frame(_best)
+    dests = sorted(df["_destination_u"].dropna().unique().tolist()) if not df.empty else []
+    return df, dests
+
+
+@st.cache_data(show_spinner=False, ttl=60, max_entries=32)
+def cached_offers_table(
+    history_version: int,
+    run_id: Optional[str],
+    route_key: Optional[str],
+    _history: pd.DataFrame,
+) -> pd.DataFrame:
+    # history_version (offset do HistoryTail) + filtros formam a chave; o frame não é hasheado
+    filtered = filter_history(_history, run_id=run_id, route_key=route_key)
+    if filtered.empty:
+        return filtered
+    return build_offers_table(filtered)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def history_file_info(path: str, mtime_ns: int, size: int) -> Tuple[int, List[str]]:
+    # mtime_ns/size só compõem a chave: arquivo inalterado = nenhum I/O no rerun
+    p = Path(path)
+    return count_lines(p), [ln[:2000] for ln in tail_lines(p, 5)]
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(df_key: Tuple[Any, ...], _df: pd.DataFrame) -> bytes:
+    # _df não entra no hash do cache (prefixo "_"); df_key identifica o conteúdo
+    # escreve direto num buffer binário: sem o str intermediário + encode
+    buf = io.BytesIO()
+    _df.to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_jsonl_bytes(df_key: Tuple[Any, ...], _df: pd.DataFrame) -> bytes:
+    # writer JSON em C do pandas, direto do frame: sem o to_dict(records) intermediário
+    # nem um dumps por linha (nulos -> null, 1 objeto por linha)
+    return _df.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8")
 
 
 # -----------------------------
@@ -139,10 +122,13 @@ def dedupe_offers_table(df: pd.DataFrame) -> pd.DataFrame:
 st.set_page_config(page_title="Flight Agent — Dashboard", layout="wide")
 st.title("✈️ Flight Agent — Dashboard")
 
-state = read_json(STATE_FILE, {})
-best = read_json(BEST_FILE, {})
-alerts = read_json(ALERTS_FILE, {})
-history_df = read_jsonl(HISTORY_FILE)
+# uma listagem do data/ (scandir) dá existência + (mtime, tamanho) de todos os arquivos
+data_files = list_dir_files(DATA_DIR)
+state = cached_json(str(STATE_FILE), data_files.get(STATE_FILE.name, (0, 0)))
+best_version = data_files.get(BEST_FILE.name, (0, 0))
+best = cached_json(str(BEST_FILE), best_version)
+alerts = cached_json(str(ALERTS_FILE), data_files.get(ALERTS_FILE.name, (0, 0)))
+history_version, history_df = get_history_tail(str(HISTORY_FILE)).snapshot()
 
 # Header metrics
 run_id = (state or {}).get("run_id")
@@ -155,18 +141,19 @@ c5.metric("Duration (sec)", safe_int((state or {}).get("duration_sec"), 0))
 
 st.caption(
     f"Data dir: `{DATA_DIR}` | "
-    f"best_offers.json: {'OK' if BEST_FILE.exists() else 'MISSING'} | "
-    f"alerts.json: {'OK' if ALERTS_FILE.exists() else 'MISSING'}"
+    f"best_offers.json: {'OK' if BEST_FILE.name in data_files else 'MISSING'} | "
+    f"alerts.json: {'OK' if ALERTS_FILE.name in data_files else 'MISSING'}"
 )
 
 # Sidebar controls
+# run fora do form (as opções de rota dependem dele); os filtros dependentes ficam
+# num st.form: mudanças neles só geram rerun ao clicar em "Aplicar"
 st.sidebar.header("Filtros")
 
 only_latest = st.sidebar.checkbox("Mostrar apenas o último run", value=True)
 
-available_run_ids: List[str] = []
-if not history_df.empty and "run_id" in history_df.columns:
-    available_run_ids = sorted([x for x in history_df["run_id"].dropna().astype(str).unique().tolist()], reverse=True)
+facets = history_facets(history_version, history_df)
+available_run_ids: List[str] = sorted((k for k in facets if k is not None), reverse=True)
 
 latest_run_from_state = str(run_id) if run_id else (available_run_ids[0] if available_run_ids else None)
 
@@ -180,21 +167,13 @@ else:
     selected_run = latest_run_from_state
 
 # Apply run filter
-filtered_history = history_df.copy()
-if not filtered_history.empty and "run_id" in filtered_history.columns:
-    if only_latest and latest_run_from_state:
-        filtered_history = filtered_history[filtered_history["run_id"].astype(str) == str(latest_run_from_state)].copy()
-    elif selected_run:
-        filtered_history = filtered_history[filtered_history["run_id"].astype(str) == str(selected_run)].copy()
-
-# Route filter options
-route_options: List[str] = []
-if not filtered_history.empty and "route_key" in filtered_history.columns:
-    route_options = sorted([x for x in filtered_history["route_key"].dropna().astype(str).unique().tolist()])
-route_filter = st.sidebar.selectbox("Rota (route_key)", ["(Todas)"] + route_options, index=0)
-
-if route_filter != "(Todas)" and not filtered_history.empty and "route_key" in filtered_history.columns:
-    filtered_history = filtered_history[filtered_history["route_key"].astype(str) == route_filter].copy()
+active_run = latest_run_from_state if only_latest else selected_run
+
+# Route filter options (do run ativo; sem run, todas)
+route_options: List[str] = facets.get(str(active_run) if active_run else None, [])
+filters_form = st.sidebar.form("filtros")
+route_filter = filters_form.selectbox("Rota (route_key)", ["(Todas)"] + route_options, index=0)
+filters_form.form_submit_button("Aplicar filtros")
 
 # -----------------------------
 # Alerts section
@@ -213,71 +192,41 @@ else:
 # -----------------------------
 st.subheader("🏆 Best Offer (sempre mostra)")
 
-best_by_route = (best or {}).get("by_route") or {}
-best_rows = []
-for k, v in best_by_route.items():
-    if not isinstance(v, dict):
-        continue
-    best_rows.append({
-        "route_key": k,
-        "origin": v.get("origin"),
-        "destination": v.get("destination"),
-        "adults": v.get("adults"),
-        "children": v.get("children"),
-        "departure_date": v.get("departure_date"),
-        "return_date": v.get("return_date"),
-        "carrier": v.get("carrier"),
-        "stops": v.get("stops"),
-        "price_total": v.get("price_total"),
-        "note": v.get("note"),
-    })
-
-best_df = pd.DataFrame(best_rows)
-if best_df.empty:
-    st.warning("Nenhuma best offer disponível ainda (best_offers.json vazio ou sem rotas).")
-else:
-    # filtro destino no best
-    dests = sorted([x for x in best_df["destination"].dropna().astype(str).unique().tolist()])
+
+@st.fragment
+def best_offers_section(best_df: pd.DataFrame, dests: List[str]) -> None:
+    # fragment: trocar o destino só reexecuta este bloco (histórico/gráfico não são refeitos)
     dest_sel = st.selectbox("Destino", ["(Todos)"] + dests, index=0)
-    view = best_df.copy()
+    view = best_df
     if dest_sel != "(Todos)":
-        view = view[view["destination"].astype(str) == dest_sel].copy()
+        view = view[view["_destination_u"] == dest_sel]
 
-    view["price_total_fmt"] = view["price_total"].apply(money)
+    # assign devolve frame novo: o best_df em cache não é alterado
+    view = view.assign(price_total_fmt=money_series(view["price_total"]))
     cols = ["route_key","origin","destination","adults","children","departure_date","return_date","carrier","stops","price_total_fmt","note"]
     cols = [c for c in cols if c in view.columns]
     st.dataframe(view[cols], width="stretch", height=240)
 
+
+best_df, best_dests = cached_best_view(best_version, best)
+if best_df.empty:
+    st.warning("Nenhuma best offer disponível ainda (best_offers.json vazio ou sem rotas).")
+else:
+    best_offers_section(best_df, best_dests)
+
 # -----------------------------
 # History section (offers)
 # -----------------------------
 st.subheader("📈 Histórico (amostra do history.jsonl)")
 
-if filtered_history.empty:
+# extrair um "price" útil pro gráfico/tabela (+ cia/stops, dedupe) — em cache por versão/filtro
+# (filtro aplicado uma vez só, dentro do cache; vazio aqui = sem linhas para o filtro)
+offers_key = (history_version, active_run, route_filter if route_filter != "(Todas)" else None)
+df = cached_offers_table(*offers_key, history_df)
+
+if df.empty:
     st.warning("Sem linhas no histórico para o filtro atual (ou history.jsonl vazio).")
 else:
-    # extrair um "price" útil pro gráfico/tabela
-    df = filtered_history.copy()
-
-    # garantir colunas básicas
-    for col in ["departure_date","return_date","origin","destination","route_key","ts_utc"]:
-        if col not in df.columns:
-            df[col] = None
-
-    # preço / cia / stops
-    # (usa apply em dict-like via to_dict por linha; é mais robusto com normalize)
-    as_dicts = df.to_dict(orient="records")
-    prices = [offer_price_from_history_row(r) for r in as_dicts]
-    carriers = [carrier_from_offer(r) for r in as_dicts]
-    stops = [stops_from_offer(r) for r in as_dicts]
-
-    df["price_total"] = prices
-    df["carrier"] = carriers
-    df["stops"] = stops
-
-    # dedupe para não repetir 10x igual
-    df = dedupe_offers_table(df)
-
     # tabela “ofertas”
     show_cols = [
         "ts_utc",
@@ -290,10 +239,32 @@ else:
         "price_total",
     ]
     show_cols = [c for c in show_cols if c in df.columns]
-    tdf = df[show_cols].copy()
-    tdf["price_total"] = tdf["price_total"].apply(money)
-
-    st.dataframe(tdf.sort_values(by=["ts_utc"], ascending=False).head(200), width="stretch", height=300)
+    # formata só as 200 linhas exibidas (o df numérico segue intacto para export/gráfico)
+    tdf = newest_first(df[show_cols]).head(200).copy()
+    tdf["price_total"] = money_series(tdf["price_total"])
+
+    st.dataframe(tdf, width="stretch", height=300)
+
+    # downloads: geração adiada (callable) — os bytes só são montados no clique,
+    # e ficam em cache enquanto o filtro não mudar
+    # a chave do export é a mesma da tabela (versão + filtros): sem hashear o frame a cada rerun
+    export_df = df[show_cols]
+    export_key = (*offers_key, tuple(show_cols))
+    d1, d2 = st.columns(2)
+    d1.download_button(
+        "📥 Baixar CSV (histórico filtrado)",
+        data=partial(to_csv_bytes, export_key, export_df),
+        file_name="history_filtered.csv",
+        mime="text/csv",
+        on_click="ignore",
+    )
+    d2.download_button(
+        "📥 Baixar JSONL (histórico filtrado)",
+        data=partial(to_jsonl_bytes, export_key, export_df),
+        file_name="history_filtered.jsonl",
+        mime="application/x-ndjson",
+        on_click="ignore",
+    )
 
     # gráfico (por departure/return)
     st.markdown("**Preço por data (menor preço por par ida/volta)**")
@@ -301,18 +272,24 @@ else:
     if g.empty:
         st.info("Sem preços válidos no histórico filtrado (price_total não encontrado nas offers).")
     else:
-        g["pair"] = g["departure_date"].astype(str) + " → " + g["return_date"].astype(str)
-        agg = g.groupby("pair", as_index=False)["price_total"].min().sort_values("price_total", ascending=True)
+        g["pair"] = (g["departure_date"].astype(str) + " → " + g["return_date"].astype(str)).astype("category")
+        agg = g.groupby("pair", as_index=False, observed=True, sort=False)["price_total"].min().sort_values("price_total", ascending=True)
         st.bar_chart(agg.set_index("pair")["price_total"], width="stretch", height=220)
 
 # -----------------------------
 # Debug section
 # -----------------------------
 with st.expander("🧪 Debug — JSON carregados"):
-    st.write(f"STATE_FILE: {STATE_FILE} exists? {STATE_FILE.exists()}")
-    st.write(f"BEST_FILE: {BEST_FILE} exists? {BEST_FILE.exists()}")
-    st.write(f"ALERTS_FILE: {ALERTS_FILE} exists? {ALERTS_FILE.exists()}")
-    st.write(f"HISTORY_FILE: {HISTORY_FILE} exists? {HISTORY_FILE.exists()}")
+    st.write(f"STATE_FILE: {STATE_FILE} exists? {STATE_FILE.name in data_files}")
+    st.write(f"BEST_FILE: {BEST_FILE} exists? {BEST_FILE.name in data_files}")
+    st.write(f"ALERTS_FILE: {ALERTS_FILE} exists? {ALERTS_FILE.name in data_files}")
+    st.write(f"HISTORY_FILE: {HISTORY_FILE} exists? {HISTORY_FILE.name in data_files}")
+    st.write(f"data/: {', '.join(sorted(data_files)) or '(vazio)'}")
+    if HISTORY_FILE.name in data_files:
+        h_mtime, h_size = data_files[HISTORY_FILE.name]
+        n_lines, tail = history_file_info(str(HISTORY_FILE), h_mtime, h_size)
+        st.write(f"history.jsonl: {n_lines} linhas ({h_size:,} bytes) — últimas {len(tail)}:")
+        st.code("\n".join(tail) or "(vazio)", language="json")
 
     payload = {"state": state, "best": best, "alerts": alerts}
     st.json(payload)
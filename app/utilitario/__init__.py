@@ -4,52 +4,50 @@ utilitario package
 Exports:
 - HistoryStore
 - analytics helpers
+- history_core (loader/normalização do dashboard)
+
+Os submódulos são importados sob demanda (no primeiro acesso ao nome):
+`from utilitario.history_core import ...` não carrega history_store/analytics.
 """
+from __future__ import annotations
+
+import importlib
+from typing import Any
+
+_EXPORTS = {
+    "HistoryStore": ".history_store",
+    "get_store": ".history_store",
+    "load_events": ".analytics",
+    "filter_events": ".analytics",
+    "last_n_days": ".analytics",
+    "count_by_type": ".analytics",
+    "count_by_key": ".analytics",
+    "time_series_daily_count": ".analytics",
+    "numeric_summary": ".analytics",
+    "group_numeric_by_key": ".analytics",
+    "build_dashboard_snapshot": ".analytics",
+    "query_events_for_table": ".analytics",
+    "query_events_columnar": ".analytics",
+    "HistoryTail": ".history_core",
+    "filter_history": ".history_core",
+    "build_offers_table": ".history_core",
+    "best_offers_frame": ".history_core",
+}
+
+
+def __getattr__(name: str) -> Any:
+    mod = _EXPORTS.get(name)
+    if mod is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Import "suave" (não mata o app se algo estiver faltando): o nome vira None
+    # e o erro fica em _<submódulo>_import_error
+    try:
+        value = getattr(importlib.import_module(mod, __name__), name)
+    except Exception as e:
+        value = None
+        globals()[f"_{mod[1:]}_import_error"] = e
+    globals()[name] = value
+    return value
+
 
-# Import "suave" (não mata o app se algo estiver faltando)
-try:
-    from .history_store import HistoryStore
-except Exception as e:
-    HistoryStore = None  # type: ignore
-    _history_store_import_error = e  # noqa
-
-try:
-    from .analytics import (
-        load_events,
-        filter_events,
-        last_n_days,
-        count_by_type,
-        count_by_key,
-        time_series_daily_count,
-        numeric_summary,
-        group_numeric_by_key,
-        build_dashboard_snapshot,
-        query_events_for_table,
-    )
-except Exception as e:
-    # Se analytics também quebrar, o app ainda sobe e você vê o erro no Streamlit
-    load_events = None  # type: ignore
-    filter_events = None  # type: ignore
-    last_n_days = None  # type: ignore
-    count_by_type = None  # type: ignore
-    count_by_key = None  # type: ignore
-    time_series_daily_count = None  # type: ignore
-    numeric_summary = None  # type: ignore
-    group_numeric_by_key = None  # type: ignore
-    build_dashboard_snapshot = None  # type: ignore
-    query_events_for_table = None  # type: ignore
-    _analytics_import_error = e  # noqa
-
-__all__ = [
-    "HistoryStore",
-    "load_events",
-    "filter_events",
-    "last_n_days",
-    "count_by_type",
-    "count_by_key",
-    "time_series_daily_count",
-    "numeric_summary",
-    "group_numeric_by_key",
-    "build_dashboard_snapshot",
-    "query_events_for_table",
-]
+__all__ = list(_EXPORTS)
@@ -1,47 +1,146 @@
 from __future__ import annotations
 
+import time
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from utilitario.history_store import HistoryStore
+import numpy as np
+import pandas as pd
 
+from utilitario.history_store import HistoryStore, get_store, parse_ts
 
-@dataclass
+
+# slots: sem __dict__ por instância; frozen: instâncias em cache não podem ser alteradas
+@dataclass(slots=True, frozen=True)
 class EventRow:
     ts_utc: datetime
     type: str
     payload: Dict[str, Any]
 
 
-def _parse_ts(ts: str) -> Optional[datetime]:
-    try:
-        dt = datetime.fromisoformat(ts)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
-    except Exception:
+def _types_set(event_types: Optional[Union[str, Iterable[str]]]) -> Optional[set]:
+    # vazio ("", [], só strings vazias) = sem filtro, como o antigo `if event_types:`
+    if event_types is None:
+        return None
+    if isinstance(event_types, str):
+        event_types = (event_types,)
+    types_set = {t for t in event_types if t}
+    return types_set or None
+
+
+def _days_ago(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def _to_row(e: Dict[str, Any]) -> Optional[EventRow]:
+    ts = e.get("ts_utc")
+    et = e.get("type")
+    payload = e.get("payload") or {}
+    if not isinstance(payload, dict):
+        payload = {"value": payload}
+    if not isinstance(ts, str) or not isinstance(et, str):
+        return None
+    dt = parse_ts(ts)
+    if dt is None:
         return None
+    return EventRow(ts_utc=dt, type=et, payload=payload)
 
 
-def load_events(store: HistoryStore) -> List[EventRow]:
+def load_events(
+    store: HistoryStore,
+    *,
+    since: Optional[datetime] = None,
+    event_types: Optional[Union[str, Iterable[str]]] = None,
+) -> List[EventRow]:
+    """
+    Carrega eventos do store, em ordem de ts_utc. since/event_types são repassados
+    ao scan do store (só as linhas que passam viram EventRow).
+    """
     rows: List[EventRow] = []
-    for e in store.all():
-        ts = e.get("ts_utc")
-        et = e.get("type")
-        payload = e.get("payload") or {}
-        if not isinstance(payload, dict):
-            payload = {"value": payload}
-        if not isinstance(ts, str) or not isinstance(et, str):
-            continue
-        dt = _parse_ts(ts)
-        if dt is None:
+    in_order = True
+    prev: Optional[datetime] = None
+    for e in store.all(since=since, types=_types_set(event_types)):
+        row = _to_row(e)
+        if row is None:
             continue
-        rows.append(EventRow(ts_utc=dt, type=et, payload=payload))
-    rows.sort(key=lambda r: r.ts_utc)
+        if prev is not None and row.ts_utc < prev:
+            in_order = False
+        prev = row.ts_utc
+        rows.append(row)
+    # o store é append-only (ts crescente): só ordena se achou alguma inversão
+    if not in_order:
+        rows.sort(key=lambda r: r.ts_utc)
     return rows
 
 
+def iter_events_reverse(
+    store: HistoryStore,
+    *,
+    event_types: Optional[Union[str, Iterable[str]]] = None,
+) -> Iterator[EventRow]:
+    """EventRows do mais novo para o mais antigo, parseados sob demanda a partir do fim do store."""
+    for e in store.iter_reverse(_types_set(event_types)):
+        row = _to_row(e)
+        if row is not None:
+            yield row
+
+
+def _tail_events(
+    store_name: str,
+    event_types: Optional[Union[str, Iterable[str]]],
+    days: Optional[int],
+    limit: int,
+) -> List[EventRow]:
+    """
+    Últimos `limit` eventos (em ordem cronológica) lendo o store de trás para frente:
+    para assim que junta `limit` eventos ou passa do início da janela de `days`
+    (store append-only: dali para trás tudo é mais antigo). limit <= 0: sem limite.
+    """
+    since = _days_ago(days) if days is not None else None
+    out: List[EventRow] = []
+    for r in iter_events_reverse(get_store(store_name), event_types=event_types):
+        if since is not None and r.ts_utc < since:
+            break
+        out.append(r)
+        if len(out) == limit:
+            break
+    out.reverse()
+    return out
+
+
+# cache em memória das leituras do store (chave = versão do arquivo + filtros);
+# o bucket de tempo faz a janela "últimos N dias" andar mesmo sem append novo
+EVENTS_CACHE_TTL = 30
+
+
+@lru_cache(maxsize=16)
+def _cached_events(
+    store_name: str,
+    version: Tuple[int, int, int],
+    days: Optional[int],
+    types_key: Optional[Tuple[str, ...]],
+    ttl_bucket: int,
+) -> Tuple[EventRow, ...]:
+    store = get_store(store_name)
+    since = _days_ago(days) if days is not None else None
+    return tuple(load_events(store, since=since, event_types=types_key))
+
+
+def _cache_key(
+    store_name: str,
+    days: Optional[int],
+    event_types: Optional[Union[str, Iterable[str]]],
+) -> Tuple[str, Tuple[int, int, int], Optional[int], Optional[Tuple[str, ...]], int]:
+    # (store, versão do arquivo, janela, tipos ordenados, bucket de tempo): tudo hasheável e barato
+    types_set = _types_set(event_types)
+    types_key = tuple(sorted(types_set)) if types_set else None
+    version = get_store(store_name).version()
+    return store_name, version, days, types_key, int(time.time() // EVENTS_CACHE_TTL)
+
+
 def filter_events(
     events: List[EventRow],
     event_types: Optional[Union[str, Iterable[str]]] = None,
@@ -49,11 +148,7 @@ def filter_events(
     since: Optional[datetime] = None,
     until: Optional[datetime] = None,
 ) -> List[EventRow]:
-    types_set = None
-    if isinstance(event_types, str):
-        types_set = {event_types}
-    elif event_types is not None:
-        types_set = set(event_types)
+    types_set = _types_set(event_types)
 
     if since and since.tzinfo is None:
         since = since.replace(tzinfo=timezone.utc)
@@ -73,38 +168,115 @@ def filter_events(
 
 
 def last_n_days(events: List[EventRow], days: int) -> List[EventRow]:
-    now = datetime.now(timezone.utc)
-    return filter_events(events, since=now - timedelta(days=days))
+    return filter_events(events, since=_days_ago(days))
 
 
 def count_by_type(events: List[EventRow]) -> Dict[str, int]:
-    out: Dict[str, int] = {}
-    for r in events:
-        out[r.type] = out.get(r.type, 0) + 1
-    return out
+    # Counter conta em C; devolve do tipo mais frequente para o menos (pronto pro gráfico)
+    return dict(Counter(r.type for r in events).most_common())
 
 
 def time_series_daily_count(events: List[EventRow], event_type: Optional[str] = None) -> List[Tuple[str, int]]:
-    out: Dict[str, int] = {}
-    for r in events:
-        if event_type and r.type != event_type:
-            continue
-        day = r.ts_utc.date().isoformat()
-        out[day] = out.get(day, 0) + 1
-    return sorted(out.items(), key=lambda x: x[0])
+    # conta por date (hash barato); a string "YYYY-MM-DD" só é gerada uma vez por dia distinto
+    per_day = Counter(
+        r.ts_utc.date() for r in events if not event_type or r.type == event_type
+    )
+    return [(day.isoformat(), n) for day, n in sorted(per_day.items())]
 
 
-def build_dashboard_snapshot(
-    store_name: str = "default",
-    *,
-    days: int = 30,
-    type_filter: Optional[Union[str, Iterable[str]]] = None,
+@lru_cache(maxsize=128)
+def _path_accessor(path: str) -> Callable[[Dict[str, Any]], Any]:
+    """
+    Leitor de payload[path] ("a.b" = aninhado) montado uma vez por caminho:
+    o split e a closure saem do laço por evento.
+    """
+    if "." not in path:
+        return lambda d: d.get(path)
+    parts = tuple(path.split("."))
+
+    def get(d: Dict[str, Any]) -> Any:
+        cur: Any = d
+        for p in parts:
+            if not isinstance(cur, dict) or p not in cur:
+                return None
+            cur = cur[p]
+        return cur
+
+    return get
+
+
+def _payload_values(events: List[EventRow], path: str) -> pd.Series:
+    # só a coluna pedida: sem achatar o payload inteiro
+    get = _path_accessor(path)
+    return pd.Series([get(r.payload) for r in events], dtype="object")
+
+
+def _numeric(values: pd.Series) -> pd.Series:
+    # só escalares viram número (listas/dicts -> NaN, como texto não numérico)
+    scalars = values.where(values.map(lambda v: isinstance(v, (int, float, str))))
+    return pd.to_numeric(scalars, errors="coerce")
+
+
+def count_by_key(events: List[EventRow], key: str) -> Dict[str, int]:
+    """Contagem por valor de payload[key] (caminho com ponto para aninhados), do mais frequente."""
+    # Counter conta em C direto do gerador (sem Series intermediária);
+    # str() antes de contar: listas/dicts no payload não são hasheáveis
+    get = _path_accessor(key)
+    values = (get(r.payload) for r in events)
+    return dict(Counter(str(v) for v in values if v is not None).most_common())
+
+
+def _group_stats(
+    group_ids: np.ndarray, values: np.ndarray, ngroups: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    sum/count/min/max de values por grupo (ids 0..ngroups-1), em kernels numpy:
+    bincount para soma/contagem e minimum.at/maximum.at para os extremos.
+    """
+    sums = np.bincount(group_ids, weights=values, minlength=ngroups)
+    counts = np.bincount(group_ids, minlength=ngroups)
+    mins = np.full(ngroups, np.inf)
+    maxs = np.full(ngroups, -np.inf)
+    np.minimum.at(mins, group_ids, values)
+    np.maximum.at(maxs, group_ids, values)
+    return sums, counts, mins, maxs
+
+
+def _stats_dict(s: float, n: int, lo: float, hi: float) -> Dict[str, float]:
+    return {"count": float(n), "sum": float(s), "mean": float(s / n), "min": float(lo), "max": float(hi)}
+
+
+def numeric_summary(events: List[EventRow], path: str) -> Dict[str, float]:
+    """count/sum/mean/min/max de payload[path] (valores não numéricos são ignorados)."""
+    values = _numeric(_payload_values(events, path)).dropna().to_numpy(dtype="float64")
+    if not len(values):
+        return {"count": 0}
+    sums, counts, mins, maxs = _group_stats(np.zeros(len(values), dtype=np.intp), values, 1)
+    return _stats_dict(sums[0], counts[0], mins[0], maxs[0])
+
+
+def group_numeric_by_key(events: List[EventRow], group_key: str, value_path: str) -> Dict[str, Dict[str, float]]:
+    """numeric_summary de payload[value_path] para cada valor de payload[group_key] (chaves ordenadas)."""
+    groups = _payload_values(events, group_key)
+    values = _numeric(_payload_values(events, value_path))
+    ok = groups.notna() & values.notna()
+    if not ok.any():
+        return {}
+    # chaves como str (como em count_by_key) -> ids 0..n-1 na ordem das chaves
+    ids, keys = pd.factorize(groups[ok].map(str), sort=True)
+    sums, counts, mins, maxs = _group_stats(ids, values[ok].to_numpy(dtype="float64"), len(keys))
+    return {k: _stats_dict(*stats) for k, *stats in zip(keys, sums, counts, mins, maxs)}
+
+
+@lru_cache(maxsize=16)
+def _cached_snapshot(
+    store_name: str,
+    version: Tuple[int, int, int],
+    days: Optional[int],
+    types_key: Optional[Tuple[str, ...]],
+    ttl_bucket: int,
 ) -> Dict[str, Any]:
-    store = HistoryStore(store_name)
-    events = load_events(store)
-    events = last_n_days(events, days)
-    if type_filter:
-        events = filter_events(events, event_types=type_filter)
+    events = _cached_events(store_name, version, days, types_key, ttl_bucket)
     return {
         "store_name": store_name,
         "days": days,
@@ -114,27 +286,63 @@ def build_dashboard_snapshot(
     }
 
 
+def build_dashboard_snapshot(
+    store_name: str = "default",
+    *,
+    days: int = 30,
+    type_filter: Optional[Union[str, Iterable[str]]] = None,
+) -> Dict[str, Any]:
+    """
+    Snapshot agregado, em cache pela mesma chave das leituras (versão do store +
+    filtros + bucket de EVENTS_CACHE_TTL): reruns sem append novo não reagregam.
+    """
+    snap = _cached_snapshot(*_cache_key(store_name, days, type_filter))
+    # cópia rasa das partes mutáveis: quem chama pode alterar sem sujar o cache
+    return {**snap, "count_by_type": dict(snap["count_by_type"]), "daily_counts": list(snap["daily_counts"])}
+
+
 def query_events_for_table(
     store_name: str = "default",
     *,
     event_types: Optional[Union[str, Iterable[str]]] = None,
     days: Optional[int] = None,
     limit: int = 5000,
-) -> List[Dict[str, Any]]:
-    store = HistoryStore(store_name)
-    events = load_events(store)
-    if days is not None:
-        events = last_n_days(events, days)
-    if event_types:
-        events = filter_events(events, event_types=event_types)
-
-    out: List[Dict[str, Any]] = []
-    for r in events[-limit:]:
-        out.append(
-            {
-                "ts_utc": r.ts_utc.isoformat(),
-                "type": r.type,
-                **r.payload,  # payload “achatado” vira colunas
-            }
-        )
-    return out
+) -> pd.DataFrame:
+    """
+    Últimos `limit` eventos como DataFrame pronto para st.dataframe: ts_utc (ISO), type
+    e o payload achatado em colunas (aninhados viram "a.b") num único json_normalize.
+    Chave do payload com o mesmo nome de ts_utc/type prevalece (como no **payload).
+    """
+    tail = _tail_events(store_name, event_types, days, limit)
+    df = pd.json_normalize([r.payload for r in tail]) if tail else pd.DataFrame()
+    if "type" not in df.columns:
+        df.insert(0, "type", [r.type for r in tail])
+    if "ts_utc" not in df.columns:
+        df.insert(0, "ts_utc", [r.ts_utc.isoformat() for r in tail])
+    return df
+
+
+def query_events_columnar(
+    store_name: str = "default",
+    *,
+    event_types: Optional[Union[str, Iterable[str]]] = None,
+    days: Optional[int] = None,
+    limit: int = 5000,
+) -> Dict[str, List[Any]]:
+    """
+    Eventos em colunas ({coluna: valores}) sem pandas e sem achatar payloads aninhados
+    (dicts ficam como valor da coluna). Chaves ausentes num evento ficam None.
+    """
+    events = _tail_events(store_name, event_types, days, limit)
+    n = len(events)
+    cols: Dict[str, List[Any]] = {
+        "ts_utc": [r.ts_utc.isoformat() for r in events],
+        "type": [r.type for r in events],
+    }
+    for i, r in enumerate(events):
+        for k, v in r.payload.items():
+            col = cols.get(k)
+            if col is None:
+                col = cols[k] = [None] * n
+            col[i] = v  # payload sobrescreve ts_utc/type, igual ao **payload da versão em linhas
+    return cols
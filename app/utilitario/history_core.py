@@ -0,0 +1,346 @@
+"""
+Núcleo compartilhado do dashboard (sem dependência de Streamlit).
+
+Leitura do history.jsonl / snapshots JSON, normalização da tabela de ofertas
+e filtros. As páginas Streamlit só envolvem estas funções com cache.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utilitario.jsonio import iter_lines_reversed, json_loads
+
+
+def read_json(path: Path, default: Any) -> Any:
+    try:
+        if not path.exists():
+            return default
+        raw = path.read_bytes().strip()
+        if not raw:
+            return default
+        # parse direto dos bytes: evita o decode intermediário em str
+        return json_loads(raw)
+    except Exception:
+        return default
+
+
+def list_dir_files(path: Path) -> Dict[str, Tuple[int, int]]:
+    """
+    {nome: (mtime_ns, tamanho)} dos arquivos do diretório, via os.scandir
+    (uma listagem só; sem Path/exists()/stat() separado por arquivo).
+    """
+    out: Dict[str, Tuple[int, int]] = {}
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                if e.is_file():
+                    st = e.stat()
+                    out[e.name] = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        pass
+    return out
+
+
+def count_lines(path: Path, chunk_size: int = 1 << 20) -> int:
+    """Conta linhas lendo em blocos binários (memória constante)."""
+    n = 0
+    with path.open("rb") as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                break
+            n += buf.count(b"\n")
+    return n
+
+
+def tail_lines(path: Path, n: int) -> List[str]:
+    """
+    Últimas n linhas não vazias, lendo o arquivo de trás pra frente em blocos
+    (iter_lines_reversed) — I/O proporcional ao tail.
+    """
+    lines: List[bytes] = []
+    if n > 0:
+        for ln in iter_lines_reversed(path):
+            if ln.strip():
+                lines.append(ln.rstrip(b"\r"))
+                if len(lines) == n:
+                    break
+    return [ln.decode("utf-8", errors="replace") for ln in reversed(lines)]
+
+
+FILTER_KEY_COLS = ("run_id", "route_key")
+PAX_COLS = ("adults", "children")
+
+
+class HistoryTail:
+    """
+    Leitura incremental do history.jsonl (append-only).
+    Guarda o offset em bytes já consumido e o DataFrame normalizado até ali;
+    cada snapshot só parseia/normaliza as linhas novas e concatena.
+    Se o arquivo encolher (reescrito/truncado), recomeça do zero.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.offset = 0
+        self.df = pd.DataFrame()
+
+    def snapshot(self) -> Tuple[int, pd.DataFrame]:
+        """
+        Lê as linhas novas e devolve (offset, frame) sob o mesmo lock: o offset
+        identifica a versão do frame devolvido (serve de chave de cache barata).
+        """
+        with self._lock:
+            df = self._refresh_locked()
+            return self.offset, df
+
+    def _refresh_locked(self) -> pd.DataFrame:
+        try:
+            if not self.path.exists():
+                self._reset()
+                return self.df
+            size = self.path.stat().st_size
+            if size < self.offset:
+                self._reset()
+            if size == self.offset:
+                return self.df
+
+            with self.path.open("rb") as f:
+                f.seek(self.offset)
+                chunk = f.read(size - self.offset)
+        except Exception:
+            return self.df
+
+        # só consome linhas completas (a última pode estar sendo escrita)
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return self.df
+
+        rows: List[Dict[str, Any]] = []
+        for line in chunk[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json_loads(line))
+            except Exception:
+                continue
+
+        self.offset += end
+        if rows:
+            new_df = pd.json_normalize(rows)
+            self.df = new_df if self.df.empty else pd.concat([self.df, new_df], ignore_index=True)
+            # chaves de filtro já como string: os filtros da sidebar comparam direto,
+            # sem reconstruir astype(str) no frame inteiro a cada rerun
+            for col in FILTER_KEY_COLS:
+                if col in self.df.columns:
+                    self.df[col] = self.df[col].astype("string")
+            # pax como inteiro nullable (sem o float 2.0 que o json_normalize gera com NaN)
+            for col in PAX_COLS:
+                if col in self.df.columns:
+                    self.df[col] = pd.to_numeric(self.df[col], errors="coerce").astype("Int64")
+        return self.df
+
+
+_BRL_SEPARATORS = str.maketrans(",.", ".,")
+
+
+def money_series(s: pd.Series) -> pd.Series:
+    """
+    Coluna de preços em reais ("R$ 1.234,56"): formata em "1,234.56" e troca os
+    separadores num único translate vetorizado; ausentes/inválidos viram "-".
+    """
+    v = pd.to_numeric(s, errors="coerce")
+    txt = v.map("{:,.2f}".format, na_action="ignore").astype("string")
+    return ("R$ " + txt.str.translate(_BRL_SEPARATORS)).fillna("-").astype(object)
+
+
+def safe_int(x: Any, default: int = 0) -> int:
+    try:
+        return int(x)
+    except Exception:
+        return default
+
+
+# Amadeus: offer.price.grandTotal, com fallback para offer.price.total
+PRICE_KEYS = ("offer.price.grandTotal", "offer.price.total")
+
+
+def coerce_price(col: pd.Series) -> pd.Series:
+    """Coluna de preço -> float64 (aceita "1234,56"); inválidos viram NaN."""
+    if not pd.api.types.is_numeric_dtype(col):
+        # "1234,56" -> "1234.56" num único passe de string (sem float() por linha)
+        col = col.astype("string").str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(col, errors="coerce").astype("float64")
+
+
+def first_valid(values: np.ndarray) -> np.ndarray:
+    """
+    Primeiro valor não-NaN de cada linha de uma matriz float (n_linhas x n_colunas).
+    argmax na máscara de válidos dá a coluna; linha toda NaN cai na coluna 0 (NaN).
+    """
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], np.nan)
+    idx = (~np.isnan(values)).argmax(axis=1)
+    return values[np.arange(values.shape[0]), idx]
+
+
+def offer_price_series(df: pd.DataFrame) -> pd.Series:
+    """
+    Extrai o preço das linhas do history.jsonl (colunas achatadas pelo json_normalize).
+    Coalesce vetorizado: primeira coluna de PRICE_KEYS com valor numérico válido.
+    """
+    cols = [
+        coerce_price(df[k]).to_numpy(dtype="float64", na_value=np.nan)
+        for k in PRICE_KEYS
+        if k in df.columns
+    ]
+    values = np.column_stack(cols) if cols else np.empty((len(df), 0))
+    return pd.Series(first_valid(values), index=df.index, dtype="float64")
+
+
+def carrier_series(df: pd.DataFrame) -> pd.Series:
+    """
+    Cia por linha (Amadeus: validatingAirlineCodes[0]), vetorizado.
+    explode() abre as listas (strings ficam intactas) e first() pega o 1º código.
+    """
+    col = "offer.validatingAirlineCodes"
+    if col not in df.columns:
+        return pd.Series("?", index=df.index, dtype="object")
+    first = df[col].explode().groupby(level=0).first()
+    return first.reindex(df.index).fillna("?").astype(str)
+
+
+def _first_itin_segments(itins: Any) -> float:
+    # nº de segments de itineraries[0]; sem a chave "segments" conta como lista vazia
+    # (0 stops, como no helper por linha antigo); NaN se não der pra inferir
+    if isinstance(itins, list) and itins and isinstance(itins[0], dict):
+        segs = itins[0].get("segments", [])
+        if isinstance(segs, list):
+            return len(segs)
+    return np.nan
+
+
+def stops_series(df: pd.DataFrame) -> pd.Series:
+    """
+    Stops por linha: itineraries[0].segments length - 1 (Int64, <NA> se não der pra inferir).
+    """
+    col = "offer.itineraries"
+    if col not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype="Int64")
+    n_segs = df[col].map(_first_itin_segments)
+    return (n_segs - 1).clip(lower=0).astype("Int64")
+
+
+def dedupe_offers_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remove duplicatas comuns quando MAX_RESULTS=10 traz muitos resultados idênticos
+    (ou quando a UI repete).
+    """
+    cols = [c for c in ["run_id", "route_key", "departure_date", "return_date", "offer.id", "offer.price.grandTotal"] if c in df.columns]
+    if cols:
+        return df.drop_duplicates(subset=cols, keep="first")
+    return df.drop_duplicates(keep="first")
+
+
+def newest_first(df: pd.DataFrame, col: str = "ts_utc") -> pd.DataFrame:
+    """
+    Ordena do mais novo para o mais antigo (nulos no fim).
+    O history.jsonl é append-only: se col já vem crescente, basta inverter (O(N));
+    só ordena de verdade quando a ordem de gravação não bate.
+    """
+    if col not in df.columns:
+        return df
+    has_ts = df[col].notna()
+    if df.loc[has_ts, col].is_monotonic_increasing:
+        return pd.concat([df[has_ts].iloc[::-1], df[~has_ts]])
+    return df.sort_values(by=[col], ascending=False)
+
+
+def filter_history(
+    df: pd.DataFrame,
+    *,
+    run_id: Optional[str] = None,
+    route_key: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Filtra o histórico por run_id e/ou route_key (colunas já em dtype string).
+    """
+    if df.empty:
+        return df
+    # uma máscara combinada e um único recorte (em vez de um frame intermediário por filtro)
+    mask = np.ones(len(df), dtype=bool)
+    if run_id and "run_id" in df.columns:
+        mask &= (df["run_id"] == str(run_id)).fillna(False).to_numpy(dtype=bool)
+    if route_key and "route_key" in df.columns:
+        mask &= (df["route_key"] == str(route_key)).fillna(False).to_numpy(dtype=bool)
+    return df[mask].copy()
+
+
+def build_offers_table(history: pd.DataFrame) -> pd.DataFrame:
+    """
+    Deriva a tabela de ofertas a partir das linhas do history.jsonl:
+    preço, cia e stops extraídos da offer crua + dedupe.
+    """
+    df = history.copy()
+
+    # garantir colunas básicas
+    for col in ["departure_date","return_date","origin","destination","route_key","ts_utc"]:
+        if col not in df.columns:
+            df[col] = None
+
+    # preço / cia / stops — tudo vetorizado (sem to_dict por linha no frame largo)
+    df["price_total"] = offer_price_series(df)
+    df["carrier"] = carrier_series(df)
+    df["stops"] = stops_series(df)
+
+    # dedupe para não repetir 10x igual
+    return dedupe_offers_table(df)
+
+
+BEST_OFFER_COLS = (
+    "route_key",
+    "origin",
+    "destination",
+    "adults",
+    "children",
+    "departure_date",
+    "return_date",
+    "carrier",
+    "stops",
+    "price_total",
+    "note",
+)
+
+
+def best_offers_frame(best: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Tabela de best offers por rota (best_offers.json -> by_route).
+    Inclui _destination_u (destino normalizado) para o filtro da UI.
+    """
+    best_by_route = (best or {}).get("by_route") or {}
+    # colunas paralelas preenchidas numa passada e um único construtor no fim
+    # (sem um dict por rota no meio)
+    cols: Dict[str, List[Any]] = {c: [] for c in BEST_OFFER_COLS}
+    for k, v in best_by_route.items():
+        if not isinstance(v, dict):
+            continue
+        cols["route_key"].append(k)
+        for c in BEST_OFFER_COLS[1:]:
+            cols[c].append(v.get(c))
+    df = pd.DataFrame(cols) if cols["route_key"] else pd.DataFrame()
+    if not df.empty:
+        df["price_total"] = coerce_price(df["price_total"])
+        # chave de filtro pronta (string, maiúscula): o filtro de destino compara direto
+        df["_destination_u"] = df["destination"].astype("string").str.strip().str.upper()
+    return df
@@ -1,17 +1,109 @@
 from __future__ import annotations
 
+import atexit
 import json
+import os
+import time
+import weakref
+from contextlib import contextmanager
 from dataclasses import asdict, dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+# ciso8601 é opcional (parser ISO-8601 em C); sem ele, datetime.fromisoformat
+try:
+    from ciso8601 import parse_datetime as _iso_parse
+except Exception:
+    _iso_parse = datetime.fromisoformat  # type: ignore
+
+# Parquet é opcional: sem pyarrow o store continua só em JSONL
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None  # type: ignore
+    ds = None  # type: ignore
+    pq = None  # type: ignore
+
+from utilitario.jsonio import iter_lines_reversed, json_dumps, json_loads
 
 
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
 
+# eventos acumulados em memória antes de virar um arquivo (row group) no dataset parquet
+PARQUET_BATCH_SIZE = 500
+# dentro de buffered(): linhas JSONL acumuladas até este volume ou idade antes de um write()
+JSONL_BUFFER_BYTES = 64 * 1024
+JSONL_BUFFER_MAX_AGE_SEC = 1.0
+
+
+_ZERO = timedelta(0)
+
+
+def parse_ts(ts: str) -> Optional[datetime]:
+    """ISO-8601 -> datetime em UTC (sem fuso = UTC); None se não der para parsear."""
+    try:
+        dt = _iso_parse(ts)
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    # caminho comum: o store grava sempre em UTC (+00:00), sem conversão de fuso
+    if dt.utcoffset() == _ZERO:
+        return dt
+    return dt.astimezone(timezone.utc)
+
+
+def _since_utc(since: Union[str, datetime, None]) -> Optional[datetime]:
+    if since is None or since == "":
+        return None
+    if isinstance(since, datetime):
+        return since.replace(tzinfo=timezone.utc) if since.tzinfo is None else since.astimezone(timezone.utc)
+    dt = parse_ts(since)
+    if dt is None:
+        raise ValueError(f"since inválido: {since!r}")
+    return dt
+
+
+def _type_needles(types_set: Set[str]) -> List[bytes]:
+    # '"type":"<x>"' (orjson) e '"type": "<x>"' (linhas gravadas com json.dumps)
+    needles = []
+    for t in types_set:
+        enc = json.dumps(t, ensure_ascii=False).encode("utf-8")
+        needles += [b'"type":' + enc, b'"type": ' + enc]
+    return needles
+
 
-@dataclass
+def _parse_block(data: bytes) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append(json_loads(line))
+        except ValueError:
+            continue
+    return rows
+
+
+# stores vivos para o flush na saída do processo: WeakSet não prende instâncias
+# avulsas (só o get_store as mantém vivas) e um único hook atexit cobre todas
+_LIVE_STORES: "weakref.WeakSet[HistoryStore]" = weakref.WeakSet()
+
+
+def _flush_live_stores() -> None:
+    for store in list(_LIVE_STORES):
+        store.flush()
+
+
+atexit.register(_flush_live_stores)
+
+
+@dataclass(slots=True, frozen=True)
 class HistoryEvent:
     ts_utc: str
     type: str
@@ -19,33 +111,302 @@ class HistoryEvent:
 
 
 class HistoryStore:
-    def __init__(self, name: str = "default"):
+    """
+    Store de eventos append-only: a leitura devolve os eventos na ordem de gravação,
+    que é a ordem de ts_utc (cada append usa o relógio UTC do momento).
+
+    fmt="jsonl": data/<name>.jsonl (1 evento por linha).
+    fmt="parquet": data/<name>.parquet/ (dataset; cada flush grava um part-*.parquet
+    com colunas ts_utc, type e payload em JSON). Permite ler só uma janela de tempo
+    (predicate pushdown em ts_utc) sem parsear o resto.
+    fmt=None: usa parquet se o dataset já existir (e pyarrow estiver instalado).
+
+    No JSONL cada append() grava a linha na hora (outros leitores já a veem ao
+    retornar). Para lotes, buffered() acumula as linhas e grava num write() só a cada
+    JSONL_BUFFER_BYTES / JSONL_BUFFER_MAX_AGE_SEC e na saída do bloco; append_many()
+    usa esse modo. append_sync() ainda faz fsync. No parquet os eventos vão em lotes
+    de PARQUET_BATCH_SIZE (flush() grava o lote parcial; leituras do próprio store
+    fazem flush antes).
+    """
+
+    def __init__(self, name: str = "default", fmt: Optional[str] = None):
         self.name = name
-        self.path = DATA_DIR / f"{name}.jsonl"
+        if fmt is None:
+            fmt = "parquet" if pa is not None and (DATA_DIR / f"{name}.parquet").is_dir() else "jsonl"
+        if fmt not in ("jsonl", "parquet"):
+            raise ValueError(f"formato de store inválido: {fmt}")
+        if fmt == "parquet" and pa is None:
+            raise RuntimeError("pyarrow não instalado: HistoryStore(fmt='parquet') indisponível")
+        self.fmt = fmt
+        self.path = DATA_DIR / f"{name}.{fmt}"
+        self._pending: List[HistoryEvent] = []
+        self._buf: List[bytes] = []
+        self._buf_bytes = 0
+        self._buf_since = 0.0
+        self._buffering = 0  # profundidade de buffered() aninhados
+        # índice incremental do JSONL, só em memória: (inode, bytes já parseados, linhas parseadas)
+        self._index: Optional[Tuple[int, int, List[Dict[str, Any]]]] = None
+        _LIVE_STORES.add(self)
 
     def _now(self) -> str:
         return datetime.now(timezone.utc).isoformat()
 
-    def append(self, event_type: str, payload: Dict[str, Any]) -> None:
+    def _enqueue(self, event_type: str, payload: Dict[str, Any]) -> None:
         event = HistoryEvent(ts_utc=self._now(), type=event_type, payload=payload)
-        with self.path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(asdict(event), ensure_ascii=False) + "\n")
+        if self.fmt == "parquet":
+            self._pending.append(event)
+            if len(self._pending) >= PARQUET_BATCH_SIZE:
+                self.flush()
+            return
+        line = json_dumps(asdict(event)) + b"\n"
+        if not self._buf:
+            self._buf_since = time.monotonic()
+        self._buf.append(line)
+        self._buf_bytes += len(line)
 
-    def all(self) -> List[Dict[str, Any]]:
-        if not self.path.exists():
+    def append(self, event_type: str, payload: Dict[str, Any]) -> None:
+        self._enqueue(event_type, payload)
+        if self.fmt != "jsonl":
+            return
+        if (
+            self._buffering
+            and self._buf_bytes < JSONL_BUFFER_BYTES
+            and time.monotonic() - self._buf_since < JSONL_BUFFER_MAX_AGE_SEC
+        ):
+            return
+        self.flush()
+
+    @contextmanager
+    def buffered(self) -> Iterator["HistoryStore"]:
+        """
+        Bloco de appends bufferizados (opt-in): as linhas JSONL vão para o disco por
+        volume/idade do buffer e, no máximo, na saída do bloco.
+        """
+        self._buffering += 1
+        try:
+            yield self
+        finally:
+            self._buffering -= 1
+            if not self._buffering:
+                self.flush()
+
+    def append_many(self, events: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Vários (tipo, payload) de uma vez, dentro de buffered()."""
+        with self.buffered():
+            for event_type, payload in events:
+                self.append(event_type, payload)
+
+    def append_sync(self, event_type: str, payload: Dict[str, Any]) -> None:
+        """append + flush + fsync: o evento (e o que estava no buffer) já está no disco ao retornar."""
+        self._enqueue(event_type, payload)
+        self.flush(fsync=True)
+
+    def flush(self, fsync: bool = False) -> None:
+        """
+        Grava o que está em buffer: no JSONL, as linhas pendentes num único write();
+        no parquet, os eventos pendentes como um novo arquivo do dataset.
+        fsync=True força a ida ao disco (só JSONL; o parquet grava arquivo novo e fecha).
+        """
+        if self._buf:
+            data = b"".join(self._buf)
+            self._buf.clear()
+            self._buf_bytes = 0
+            # sem buffer do Python: um write() só, com linhas inteiras (O_APPEND não intercala)
+            with self.path.open("ab", buffering=0) as f:
+                f.write(data)
+                if fsync:
+                    os.fsync(f.fileno())
+        if self.fmt != "parquet" or not self._pending:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        table = pa.table(
+            {
+                "ts_utc": [e.ts_utc for e in self._pending],
+                "type": [e.type for e in self._pending],
+                "payload": [json_dumps(e.payload).decode("utf-8") for e in self._pending],
+            }
+        )
+        pq.write_table(table, self.path / f"part-{time.time_ns()}.parquet", compression="zstd")
+        self._pending.clear()
+
+    def version(self) -> Tuple[int, int, int]:
+        """
+        Chave barata do conteúdo (mtime_ns, bytes, pendentes): muda a cada append/flush.
+        Serve de chave de cache sem precisar ler/hashear os eventos.
+        """
+        self.flush()
+        mtime, size = 0, 0
+        if self.fmt == "parquet":
+            if self.path.is_dir():
+                for p in self.path.glob("*.parquet"):
+                    st = p.stat()
+                    mtime = max(mtime, st.st_mtime_ns)
+                    size += st.st_size
+        elif self.path.exists():
+            st = self.path.stat()
+            mtime, size = st.st_mtime_ns, st.st_size
+        return mtime, size, len(self._pending)
+
+    def all(
+        self,
+        since: Union[str, datetime, None] = None,
+        types: Optional[Iterable[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Todos os eventos (dicts ts_utc/type/payload).
+        since: datetime ou ISO-8601 (sem fuso = UTC). Comparado como instante (parse_ts
+        de cada ts_utc), não como string: "Z", outros fusos e frações de segundo valem.
+        types: só estes tipos de evento.
+        No parquet os filtros viram filtro do dataset; no JSONL são aplicados sobre o
+        índice incremental (all_cached), que só parseia as linhas novas, ou, sem índice
+        ainda, via iter_by_type (pré-filtro por tipo antes do parse).
+        """
+        types_set = set(types) if types is not None else None
+        since = _since_utc(since)
+        self.flush()
+        if self.fmt == "parquet":
+            return self._all_parquet(since, types_set)
+        if since is None and types_set is None:
+            return list(self.all_cached())
+        if types_set is not None and self._index is None:
+            # sem índice ainda: scan com pré-filtro por tipo (só as linhas do tipo são parseadas)
+            return [r for r in self.iter_by_type(types_set) if self._match(r.get("ts_utc"), None, since, None)]
+        return [r for r in self.all_cached() if self._match(r.get("ts_utc"), r.get("type"), since, types_set)]
+
+    def iter_by_type(self, types: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Eventos do JSONL só destes tipos, em streaming. Antes do parse, um teste de
+        substring nos bytes da linha ('"type":"<x>"' do orjson ou '"type": "<x>"' do
+        json.dumps) descarta as linhas dos outros tipos sem parseá-las.
+        """
+        types_set = set(types)
+        self.flush()
+        if self.fmt == "parquet":
+            yield from self._all_parquet(None, types_set)
+            return
+        if not types_set or not self.path.exists():
+            return
+        needles = _type_needles(types_set)
+        with self.path.open("rb") as f:
+            for line in f:
+                if not any(n in line for n in needles):
+                    continue
+                try:
+                    row = json_loads(line)
+                except ValueError:
+                    continue
+                if row.get("type") in types_set:  # needle pode casar dentro do payload
+                    yield row
+
+    def all_cached(self) -> List[Dict[str, Any]]:
+        """
+        Eventos do JSONL via índice incremental em memória: só os bytes gravados desde
+        a última leitura são lidos/parseados. A lista devolvida é do cache: não alterar.
+        """
+        if self.fmt == "parquet":
+            return self._all_parquet(None, None)
+        self.flush()
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            self._index = None
             return []
+        ino, offset, rows = self._index or (st.st_ino, 0, [])
+        if ino != st.st_ino or st.st_size < offset:
+            # arquivo trocado/truncado: reconstrói do zero
+            ino, offset, rows = st.st_ino, 0, []
+        if st.st_size > offset:
+            with self.path.open("rb") as f:
+                f.seek(offset)
+                data = f.read(st.st_size - offset)
+            end = data.rfind(b"\n") + 1  # linha final sem \n pode estar no meio da escrita
+            rows.extend(_parse_block(data[:end]))
+            offset += end
+        self._index = (ino, offset, rows)
+        return rows
+
+    def iter_reverse(self, types: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Eventos do mais novo para o mais antigo, em streaming a partir do fim do JSONL
+        (só as linhas consumidas são lidas/parseadas). Com types, pré-filtro por bytes
+        como em iter_by_type.
+        """
+        types_set = set(types) if types is not None else None
+        self.flush()
+        if self.fmt == "parquet":
+            yield from reversed(self._all_parquet(None, types_set))
+            return
+        if not self.path.exists():
+            return
+        needles = _type_needles(types_set) if types_set else None
+        for line in iter_lines_reversed(self.path):
+            if not line.strip():
+                continue
+            if needles is not None and not any(n in line for n in needles):
+                continue
+            try:
+                row = json_loads(line)
+            except ValueError:
+                continue  # inclui a última linha, se ainda estiver sendo gravada
+            if types_set is None or row.get("type") in types_set:
+                yield row
+
+    @staticmethod
+    def _match(ts: Any, event_type: Any, since: Optional[datetime], types_set: Optional[Set[str]]) -> bool:
+        if since is not None:
+            dt = parse_ts(ts) if isinstance(ts, str) else None
+            if dt is None or dt < since:
+                return False
+        if types_set is not None and event_type not in types_set:
+            return False
+        return True
+
+    def _all_parquet(self, since: Optional[datetime], types_set: Optional[Set[str]]) -> List[Dict[str, Any]]:
         rows: List[Dict[str, Any]] = []
-        with self.path.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
+        if self.path.is_dir() and any(self.path.glob("*.parquet")):
+            # colunas ts_utc/type/payload(JSON); filtros aplicados no scan (pushdown)
+            dataset = ds.dataset(self.path, format="parquet")
+            flt = None
+            if since is not None:
+                # pushdown só pelo prefixo de data (YYYY-MM-DD, largura fixa), com 1 dia de
+                # folga para fusos; o corte exato é feito por _match no instante parseado
+                flt = ds.field("ts_utc") >= (since - timedelta(days=1)).date().isoformat()
+            if types_set is not None:
+                tflt = ds.field("type").isin(sorted(types_set))
+                flt = tflt if flt is None else flt & tflt
+            for r in dataset.to_table(filter=flt).to_pylist():
+                if since is not None and not self._match(r.get("ts_utc"), None, since, None):
                     continue
                 try:
-                    rows.append(json.loads(line))
-                except json.JSONDecodeError:
+                    r["payload"] = json_loads(r["payload"]) if r.get("payload") else {}
+                except ValueError:
                     continue
+                rows.append(r)
+        for e in self._pending:
+            if self._match(e.ts_utc, e.type, since, types_set):
+                rows.append(asdict(e))
         return rows
 
     def clear(self) -> None:
+        self._pending.clear()
+        self._buf.clear()
+        self._buf_bytes = 0
+        self._index = None
+        if self.fmt == "parquet":
+            if self.path.is_dir():
+                for p in self.path.glob("*.parquet"):
+                    p.unlink()
+                self.path.rmdir()
+            return
         if self.path.exists():
             self.path.unlink()
+
+
+@lru_cache(maxsize=None)
+def get_store(name: str = "default", fmt: Optional[str] = None) -> HistoryStore:
+    """
+    Uma instância de HistoryStore por (nome, formato) no processo.
+    Evita recriar o store (detecção de formato) a cada chamada e garante que
+    leituras vejam os eventos ainda pendentes no buffer de quem gravou.
+    """
+    return HistoryStore(name, fmt)
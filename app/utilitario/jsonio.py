@@ -0,0 +1,62 @@
+"""
+Parse/serialização de JSON e leitura de JSONL de trás pra frente, compartilhados
+(dashboard, HistoryStore e scripts da raiz).
+
+Só stdlib + orjson opcional: pode ser importado sem pandas/Streamlit.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterator
+
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
+
+def json_loads(raw: Any) -> Any:
+    """
+    orjson quando disponível (parse em C, direto de bytes); cai no json da stdlib
+    se não houver orjson ou se o conteúdo usar NaN/Infinity (que o orjson rejeita).
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+
+def json_dumps(obj: Any, *, indent: bool = False) -> bytes:
+    """
+    JSON em bytes UTF-8 (compacto; indent=True: 2 espaços). orjson quando disponível;
+    tipo que o orjson não serializa cai no json da stdlib (mesmo comportamento dele).
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def iter_lines_reversed(path: Path, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Linhas do arquivo da última para a primeira, lendo blocos a partir do fim.
+    Só lê o necessário: achar as últimas linhas não depende do tamanho do arquivo.
+    """
+    with path.open("rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b""
+        while pos > 0:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + rest).split(b"\n")
+            rest = lines.pop(0)  # pode estar incompleta: completa com o bloco anterior
+            yield from reversed(lines)
+        yield rest
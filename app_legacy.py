@@ -1,6 +1,7 @@
 import streamlit as st
-from collector import collect
 import pandas as pd
+import uuid
+from functools import partial
 from io import BytesIO
 
 st.set_page_config(page_title="Flight Agent", layout="wide")
@@ -14,32 +15,44 @@ st.markdown("""
 **Moeda:** como vier da fonte
 """)
 
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def df_to_xlsx_bytes(df_id: str, _df: pd.DataFrame) -> bytes:
+    # df_id (único por busca, vale entre sessões) é a chave: o df não é hasheado
+    # e o xlsx só é reescrito (openpyxl) quando uma nova busca troca o resultado
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        _df.to_excel(writer, sheet_name="Resultados", index=False)
+    return output.getvalue()
+
+
 if "df" not in st.session_state:
     st.session_state["df"] = None
+    st.session_state["df_id"] = ""
 
 col1, col2 = st.columns([1, 1])
 
 with col1:
     if st.button("🔄 Rodar busca agora"):
+        # import só no clique: collector (requests/yaml/config) não pesa nos reruns de UI
+        from collector import collect
+
         with st.spinner("Coletando dados..."):
             df = collect()
             st.session_state["df"] = df
+            st.session_state["df_id"] = uuid.uuid4().hex
         st.success("Busca concluída.")
 
 with col2:
     df = st.session_state.get("df")
     if df is not None and isinstance(df, pd.DataFrame) and len(df) > 0:
-        # Gera excel em memória
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, sheet_name="Resultados", index=False)
-        output.seek(0)
-
+        # Excel gerado em memória só no clique (callable) e reaproveitado até a próxima busca
         st.download_button(
             label="📥 Baixar Excel (Resultados)",
-            data=output,
+            data=partial(df_to_xlsx_bytes, st.session_state.get("df_id", ""), df),
             file_name="flight_prices_latest.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
         )
     else:
         st.caption("Rode a busca para habilitar o download do Excel.")
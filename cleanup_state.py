@@ -1,26 +1,37 @@
 # cleanup_state.py
 from __future__ import annotations
 
-import json
+import os
+import sys
 from pathlib import Path
 from typing import Any, Dict, Set
 
+# mesmo nome de módulo do app Streamlit (app/ no sys.path): um único utilitario.jsonio
+sys.path.insert(0, str(Path(__file__).resolve().parent / "app"))
+from utilitario.jsonio import iter_lines_reversed, json_dumps, json_loads  # noqa: E402
+
 STATE_PATH = Path("data/state.json")
 HISTORY_PATH = Path("data/history.jsonl")
 
 
+def _write_json_atomic(path: Path, obj: Any) -> None:
+    # bytes prontos (indent 2) num .tmp + os.replace: interrupção não deixa state.json pela metade
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(json_dumps(obj, indent=True))
+    os.replace(tmp, path)
+
+
 def _last_history_keys() -> Set[str]:
     if not HISTORY_PATH.exists():
         return set()
 
-    lines = HISTORY_PATH.read_text(encoding="utf-8").splitlines()
     # pega a última linha válida (último run)
-    for line in reversed(lines):
+    for line in iter_lines_reversed(HISTORY_PATH):
         line = line.strip()
         if not line:
             continue
         try:
-            rec = json.loads(line)
+            rec = json_loads(line)
             results = rec.get("results", []) or []
             keys = {str(r.get("key")) for r in results if r.get("key")}
             return keys
@@ -34,7 +45,7 @@ def main() -> int:
         print("state.json not found, nothing to clean.")
         return 0
 
-    state: Dict[str, Any] = json.loads(STATE_PATH.read_text(encoding="utf-8"))
+    state: Dict[str, Any] = json_loads(STATE_PATH.read_bytes())
     best = state.get("best", {})
 
     if not isinstance(best, dict):
@@ -51,7 +62,7 @@ def main() -> int:
     removed = original_keys - set(cleaned_best.keys())
 
     state["best"] = cleaned_best
-    STATE_PATH.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    _write_json_atomic(STATE_PATH, state)
 
     print("Cleanup completed.")
     print(f"Kept {len(cleaned_best)} entries from last run.")
@@ -1,12 +1,29 @@
 import os
+import hashlib
 import json
+import math
+import threading
+import time
 import yaml
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from date_rules import generate_date_pairs
 
+# Optional: stream offers out of the HTTP response instead of materializing it
+try:
+    import ijson
+except Exception:
+    ijson = None  # type: ignore
+
+# libyaml C loader when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # ----------------------------
 # Amadeus endpoints (TEST)
 # If you move to production later, change BASE_URL to:
@@ -22,26 +39,126 @@ AIRLINE_LOOKUP = f"{BASE_URL}/v1/reference-data/airlines"
 # This assumes this file is at repo root: flight-agent/collector.py
 # ----------------------------
 ROOT_DIR = Path(__file__).resolve().parent
+CONFIG_PATH = ROOT_DIR / "routes.yaml"
 DEBUG_DIR = ROOT_DIR / "data" / "debug"
-DEBUG_DIR.mkdir(parents=True, exist_ok=True)
 
-DEBUG_SAVE_RAW = True  # set False later if you want
+# Raw Amadeus dumps are opt-in (DEBUG_RAW=1): without them each date pair is
+# streamed and only the normalized offer dicts are kept in memory.
+DEBUG_SAVE_RAW = os.getenv("DEBUG_RAW", "").strip().lower() in ("1", "true", "yes")
+if DEBUG_SAVE_RAW:
+    DEBUG_DIR.mkdir(parents=True, exist_ok=True)
+
+# One pooled HTTP session for every Amadeus call (keep-alive: one TCP/TLS
+# handshake per connection instead of per request). Transient errors on GETs
+# are retried with backoff; the pool fits MAX_CONCURRENT_QUERIES workers.
+# Responses are gzip-compressed (requests sends Accept-Encoding: gzip by default).
+# Still HTTP/1.1: each worker keeps its own warm connection, so handshakes are
+# paid once per worker per process, not per date pair.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,  # last response goes back to the caller
+        ),
+    ),
+)
 
-# Cache for airline name lookups
+# Cache for airline name lookups, persisted across runs in data/airline_cache.json
+# as {code: {"name": ..., "ts": epoch}}; entries older than the TTL are refetched.
+AIRLINE_CACHE_PATH = ROOT_DIR / "data" / "airline_cache.json"
+AIRLINE_CACHE_TTL_SEC = 30 * 24 * 3600
 AIRLINE_NAME_CACHE = {}
+_AIRLINE_CACHE_TS = {}  # code -> fetch time, only for names that came from the API
+# IATA codes per airlines request
+AIRLINE_LOOKUP_BATCH = 50
+
+# Normalized offers per (route, dates, pax) query, reused for a few minutes so
+# repeat collect() runs (Streamlit reloads, retries) don't re-hit the rate-limited API
+OFFERS_CACHE_DIR = ROOT_DIR / "data" / "offers_cache"
+OFFERS_CACHE_TTL_SEC = 5 * 60
+OFFERS_MAX_RESULTS = 50
+
+# OAuth token reused across collect() calls in the same process until shortly
+# before it expires (Amadeus tokens live ~30 min)
+_TOKEN_CACHE = {"key": None, "token": None, "exp": 0.0}
+TOKEN_EXPIRY_MARGIN_SEC = 60
 
 # OPTIONAL: make UI faster (limit how many date pairs to query)
 # Set to None to query all valid pairs.
 MAX_DATE_PAIRS = 3  # <-- keep 3 for faster manual runs; set None for full scan
 
+# Date-pair queries in flight at the same time
+MAX_CONCURRENT_QUERIES = 8
+
+# Token bucket shared by all Amadeus GETs (test tier allows ~10 TPS): workers
+# start a request as soon as a token is free instead of bursting into 429s.
+# Retries on 429 are done by the session's Retry, which honors Retry-After.
+AMADEUS_MAX_TPS = 10
+_RATE_LOCK = threading.Lock()
+_RATE_STATE = {"tokens": float(AMADEUS_MAX_TPS), "ts": time.monotonic()}
+
+
+def load_airline_cache() -> None:
+    try:
+        saved = json.loads(AIRLINE_CACHE_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return  # missing/corrupt cache: names are fetched again
+    now = time.time()
+    for code, entry in (saved or {}).items():
+        try:
+            name, ts = entry["name"], float(entry["ts"])
+        except Exception:
+            continue
+        if name and ts + AIRLINE_CACHE_TTL_SEC > now:
+            AIRLINE_NAME_CACHE[code] = name
+            _AIRLINE_CACHE_TS[code] = ts
+
+
+def save_airline_cache() -> None:
+    data = {c: {"name": AIRLINE_NAME_CACHE[c], "ts": ts} for c, ts in _AIRLINE_CACHE_TS.items()}
+    tmp = AIRLINE_CACHE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, AIRLINE_CACHE_PATH)  # atomic: readers never see a half-written file
+
+
+load_airline_cache()
+
+
+@lru_cache(maxsize=1)
+def _load_config_cached(mtime_ns: int):
+    with open(CONFIG_PATH, "rb") as f:
+        return yaml.load(f, Loader=_YAML_LOADER)
+
 
 def load_config():
-    with open(ROOT_DIR / "routes.yaml", "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    # parsed once per routes.yaml version: keyed on mtime so edits are still picked up
+    return _load_config_cached(os.stat(CONFIG_PATH).st_mtime_ns)
+
+
+def _rate_limit() -> None:
+    # take one token (the balance may go negative = reserved) and sleep, outside
+    # the lock, until it would have been refilled
+    with _RATE_LOCK:
+        now = time.monotonic()
+        tokens = min(float(AMADEUS_MAX_TPS), _RATE_STATE["tokens"] + (now - _RATE_STATE["ts"]) * AMADEUS_MAX_TPS)
+        _RATE_STATE["tokens"] = tokens - 1
+        _RATE_STATE["ts"] = now
+    if tokens < 1:
+        time.sleep((1 - tokens) / AMADEUS_MAX_TPS)
 
 
 def amadeus_get_token(client_id: str, client_secret: str) -> str:
-    resp = requests.post(
+    key = (client_id, client_secret)
+    if _TOKEN_CACHE["key"] == key and time.monotonic() < _TOKEN_CACHE["exp"]:
+        return _TOKEN_CACHE["token"]
+
+    resp = _SESSION.post(
         TOKEN_URL,
         data={
             "grant_type": "client_credentials",
@@ -51,7 +168,30 @@ def amadeus_get_token(client_id: str, client_secret: str) -> str:
         timeout=30,
     )
     resp.raise_for_status()
-    return resp.json()["access_token"]
+    payload = resp.json()
+    ttl = float(payload.get("expires_in") or 1799)
+    _TOKEN_CACHE.update(
+        key=key,
+        token=payload["access_token"],
+        exp=time.monotonic() + ttl - TOKEN_EXPIRY_MARGIN_SEC,
+    )
+    return _TOKEN_CACHE["token"]
+
+
+def _offers_params(origin, destination, depart, ret, adults, children, max_results, currency_code) -> dict:
+    params = {
+        "originLocationCode": origin,
+        "destinationLocationCode": destination,
+        "departureDate": depart,
+        "returnDate": ret,
+        "adults": adults,
+        "children": children,
+        # IMPORTANT: do NOT use nonStop here; we'll filter direct ourselves (more reliable)
+        "max": str(max_results),
+    }
+    if currency_code:
+        params["currencyCode"] = currency_code
+    return params
 
 
 def amadeus_search_offers(
@@ -63,14 +203,306 @@ def amadeus_search_offers(
     adults: int,
     children: int,
     max_results: int = 50,
+    currency_code: str = None,
 ) -> dict:
     headers = {"Authorization": f"Bearer {token}"}
-    params = {
-        "originLocationCode": origin,
-        "destinationLocationCode": destination,
-        "departureDate": depart,
-        "returnDate": ret,
-        "adults": adults,
-        "children": children,
-        # IMPORTANT: do NOT use nonStop here; we'll filter direct ourselves (more reliable)
-        "max": str(max_results_
+    params = _offers_params(origin, destination, depart, ret, adults, children, max_results, currency_code)
+    _rate_limit()
+    resp = _SESSION.get(FLIGHT_OFFERS, headers=headers, params=params, timeout=60)
+    if resp.status_code >= 400:
+        raise RuntimeError(f"Amadeus offers HTTP {resp.status_code}: {resp.text[:500]}")
+    return resp.json()
+
+
+def amadeus_iter_offers(
+    token: str,
+    origin: str,
+    destination: str,
+    depart: str,
+    ret: str,
+    adults: int,
+    children: int,
+    max_results: int = 50,
+    currency_code: str = None,
+):
+    """
+    Offers one at a time. With ijson installed the response body is parsed while it
+    is read (only one offer alive at a time); otherwise falls back to resp.json().
+    """
+    if ijson is None:
+        yield from amadeus_search_offers(
+            token, origin, destination, depart, ret, adults, children, max_results, currency_code
+        ).get("data") or []
+        return
+    params = _offers_params(origin, destination, depart, ret, adults, children, max_results, currency_code)
+    headers = {"Authorization": f"Bearer {token}"}
+    _rate_limit()
+    with _SESSION.get(FLIGHT_OFFERS, headers=headers, params=params, timeout=60, stream=True) as resp:
+        if resp.status_code >= 400:
+            raise RuntimeError(f"Amadeus offers HTTP {resp.status_code}: {resp.text[:500]}")
+        resp.raw.decode_content = True  # gunzip on the fly
+        yield from ijson.items(resp.raw, "data.item", use_float=True)
+
+
+def lookup_airline_names(codes, token: str) -> dict:
+    """
+    Resolve many IATA codes at once: the airlines endpoint takes a comma-separated
+    airlineCodes list, so N codes cost ceil(N / AIRLINE_LOOKUP_BATCH) requests.
+    Results (or the code itself, if unknown) go into AIRLINE_NAME_CACHE.
+    """
+    wanted = sorted({(c or "").strip().upper() for c in codes} - {""} - AIRLINE_NAME_CACHE.keys())
+    for i in range(0, len(wanted), AIRLINE_LOOKUP_BATCH):
+        chunk = wanted[i:i + AIRLINE_LOOKUP_BATCH]
+        try:
+            _rate_limit()
+            resp = _SESSION.get(
+                AIRLINE_LOOKUP,
+                headers={"Authorization": f"Bearer {token}"},
+                params={"airlineCodes": ",".join(chunk)},
+                timeout=30,
+            )
+            if resp.status_code < 400:
+                now = time.time()
+                for item in resp.json().get("data") or []:
+                    code = item.get("iataCode")
+                    if code:
+                        AIRLINE_NAME_CACHE[code] = item.get("commonName") or item.get("businessName") or code
+                        _AIRLINE_CACHE_TS[code] = now
+        except Exception:
+            pass  # lookup is cosmetic: keep the IATA code
+        for code in chunk:
+            AIRLINE_NAME_CACHE.setdefault(code, code)
+    return {c: AIRLINE_NAME_CACHE.get(c, c) for c in codes}
+
+
+def lookup_airline_name(code: str, token: str) -> str:
+    code = (code or "").strip().upper()
+    if not code:
+        return ""
+    return lookup_airline_names([code], token)[code]
+
+
+def is_roundtrip(offer: dict) -> bool:
+    # outbound + return, at least one segment each
+    itineraries = offer.get("itineraries") or []
+    return len(itineraries) == 2 and all(it.get("segments") for it in itineraries)
+
+
+def is_roundtrip_direct(offer: dict) -> bool:
+    # outbound + return, one segment each
+    itineraries = offer.get("itineraries") or []
+    return len(itineraries) == 2 and all(len(it.get("segments") or []) == 1 for it in itineraries)
+
+
+def _to_price(value) -> float:
+    # grandTotal is a decimal string; anything unparsable sorts last as NaN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def normalize_direct_offers(offers, direct_only: bool = True) -> list:
+    # offers: any iterable of offer dicts (streamed or from data_json["data"]).
+    # Only the per-offer fields: the date-pair columns (base row) are joined once
+    # in collect(), and airline names ("companhia") come from one batched lookup.
+    # direct_only=False keeps every round trip and flags direct ones in "direto".
+    keep = is_roundtrip_direct if direct_only else is_roundtrip
+    rows = []
+    for offer in (o for o in offers if keep(o)):
+
+        price = offer.get("price") or {}
+        grand_total = price.get("grandTotal") or price.get("total")
+        currency = price.get("currency")
+
+        validating = offer.get("validatingAirlineCodes") or []
+        code = validating[0] if validating else ""
+
+        out_seg = offer["itineraries"][0]["segments"][0]
+        back_seg = offer["itineraries"][1]["segments"][0]
+
+        rows.append({
+            "direto": "S" if direct_only or is_roundtrip_direct(offer) else "N",
+            "preco_total": _to_price(grand_total),
+            "moeda": currency,
+            "cia": code,
+            "partida_ida": (out_seg.get("departure") or {}).get("at"),
+            "partida_volta": (back_seg.get("departure") or {}).get("at"),
+        })
+    return rows
+
+
+def rome_route(config: dict) -> dict:
+    # The legacy UI tracks the Rome route (ROME_15D_WINDOW rule in routes.yaml)
+    routes = (config or {}).get("routes") or []
+    for r in routes:
+        if str(r.get("rule", "")).upper() == "ROME_15D_WINDOW":
+            return r
+    if not routes:
+        raise RuntimeError("routes.yaml has no routes")
+    return routes[0]
+
+
+def route_date_pairs(route: dict) -> list:
+    rp = route.get("rule_params") or {}
+    trip_days = int(rp.get("trip_days", 15))
+    start_mm, start_dd = rp.get("start_mm_dd", [9, 1])
+    ret_mm, ret_dd = rp.get("latest_return_mm_dd", [10, 5])
+
+    today = datetime.now().date()
+    year = today.year if today.month <= 10 else today.year + 1
+
+    start = date(year, int(start_mm), int(start_dd))
+    deadline = date(year, int(ret_mm), int(ret_dd))
+    end = deadline - timedelta(days=trip_days)
+    return generate_date_pairs(start.isoformat(), end.isoformat(), trip_days, deadline.isoformat())
+
+
+def _offers_cache_path(query: tuple) -> Path:
+    key = hashlib.blake2b("|".join(map(str, query)).encode("utf-8"), digest_size=16).hexdigest()
+    return OFFERS_CACHE_DIR / f"{key}.json"
+
+
+def _read_offers_cache(path: Path):
+    try:
+        if time.time() - path.stat().st_mtime > OFFERS_CACHE_TTL_SEC:
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_offers_cache(path: Path, rows: list) -> None:
+    try:
+        OFFERS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[collector] could not save offers cache: {e}")
+
+
+def _search_pair(
+    token: str,
+    route: dict,
+    base_row: dict,
+    direct_only: bool = True,
+    currency_code: str = None,
+) -> list:
+    args = (
+        token,
+        route["origin"],
+        route["destination"],
+        base_row["ida"],
+        base_row["volta"],
+        int(route.get("adults", 1)),
+        int(route.get("children", 0)),
+        OFFERS_MAX_RESULTS,
+        currency_code,
+    )
+    # cached per query (the token is not part of the key)
+    cache_path = _offers_cache_path(args[1:] + (direct_only,))
+    rows = _read_offers_cache(cache_path)
+    if rows is not None:
+        return rows
+
+    if not DEBUG_SAVE_RAW:
+        rows = normalize_direct_offers(amadeus_iter_offers(*args), direct_only)
+    else:
+        # the raw dump needs the whole response, so no streaming here
+        json_data = amadeus_search_offers(*args)
+        raw_path = DEBUG_DIR / f"offers_{route['origin']}_{route['destination']}_{base_row['ida']}_{base_row['volta']}.json"
+        raw_path.write_text(json.dumps(json_data, ensure_ascii=False), encoding="utf-8")
+        offers = json_data.get("data") or []
+        json_data = None  # drop dictionaries/meta/warnings before normalizing
+        rows = normalize_direct_offers(offers, direct_only)
+
+    _write_offers_cache(cache_path, rows)
+    return rows
+
+
+def collect(
+    direct_only: bool = None,
+    lookup_airlines: bool = True,
+    currency_code: str = None,
+    max_date_pairs: int = MAX_DATE_PAIRS,
+) -> pd.DataFrame:
+    """
+    Offers for the Rome route, cheapest first.
+
+    direct_only defaults to the route's direct_only in routes.yaml (True if unset).
+    currency_code is sent as Amadeus currencyCode; None keeps the source currency.
+    lookup_airlines=False skips the airlines endpoint ("companhia" = IATA code).
+    max_date_pairs caps the date pairs queried (None = all).
+    """
+    config = load_config()
+    route = rome_route(config)
+    if direct_only is None:
+        direct_only = bool(route.get("direct_only", True))
+
+    client_id = os.getenv("AMADEUS_CLIENT_ID", "").strip()
+    client_secret = os.getenv("AMADEUS_CLIENT_SECRET", "").strip()
+    if not client_id or not client_secret:
+        raise RuntimeError("Missing AMADEUS_CLIENT_ID / AMADEUS_CLIENT_SECRET")
+
+    token = amadeus_get_token(client_id, client_secret)
+
+    dates = route_date_pairs(route)
+    if max_date_pairs is not None:
+        dates = dates[:max_date_pairs]
+
+    # fields shared by every date pair, computed once; only ida/volta vary
+    row_const = {
+        "data_coleta": datetime.now().isoformat(timespec="seconds"),
+        "origem": route["origin"],
+        "destino": route["destination"],
+        "duracao_dias": int((route.get("rule_params") or {}).get("trip_days", 15)),
+        "adultos": int(route.get("adults", 1)),
+        "criancas": int(route.get("children", 0)),
+    }
+    base_rows = [{**row_const, "ida": depart, "volta": ret} for depart, ret in dates]
+
+    # Date pairs are independent and the run is bound by HTTP latency: a pool of
+    # MAX_CONCURRENT_QUERIES workers keeps that many requests in flight (a new one
+    # starts as soon as any finishes). A failed pair is reported and skipped.
+    offer_rows = []
+    date_idx = []  # base_rows position of each offer row
+    if base_rows:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_QUERIES, len(base_rows))) as pool:
+            futures = [
+                pool.submit(_search_pair, token, route, b, direct_only, currency_code)
+                for b in base_rows
+            ]
+            for i, (b, fut) in enumerate(zip(base_rows, futures)):
+                try:
+                    found = fut.result()
+                except Exception as e:
+                    print(f"[collector] {b['ida']} -> {b['volta']} failed: {e}")
+                    continue
+                offer_rows.extend(found)
+                date_idx.extend([i] * len(found))
+
+    if not offer_rows:
+        return pd.DataFrame()
+
+    # constant columns broadcast as scalars, ida/volta taken by position, then the
+    # per-offer columns (no base-row dict copied into every offer)
+    idx = pd.RangeIndex(len(offer_rows))
+    base = pd.DataFrame(row_const, index=idx)
+    base.insert(3, "ida", [base_rows[i]["ida"] for i in date_idx])
+    base.insert(4, "volta", [base_rows[i]["volta"] for i in date_idx])
+    df = pd.concat([base, pd.DataFrame(offer_rows, index=idx)], axis=1)
+
+    if lookup_airlines:
+        # airline names for every code seen in this run, in as few requests as possible
+        names = lookup_airline_names(set(df["cia"].dropna()) - {""}, token)
+        df["companhia"] = df["cia"].map(names).fillna("")
+        try:
+            save_airline_cache()
+        except OSError as e:
+            print(f"[collector] could not save airline cache: {e}")
+    else:
+        df["companhia"] = df["cia"].fillna("")
+
+    df = df.sort_values(["preco_total", "ida"], ascending=[True, True], na_position="last")
+    return df.reset_index(drop=True)
@@ -1,17 +1,9 @@
-from datetime import datetime, timedelta
+import pandas as pd
 
 def generate_date_pairs(start, end, length, return_deadline):
-    start = datetime.fromisoformat(start)
-    end = datetime.fromisoformat(end)
-    deadline = datetime.fromisoformat(return_deadline)
+    # all departures at once (vectorized): return = departure + length, kept if <= deadline
+    starts = pd.date_range(pd.Timestamp(start), pd.Timestamp(end), freq="D")
+    rets = starts + pd.Timedelta(days=length)
+    mask = rets <= pd.Timestamp(return_deadline)
 
-    pairs = []
-    current = start
-
-    while current <= end:
-        ret = current + timedelta(days=length)
-        if ret <= deadline:
-            pairs.append((current.date().isoformat(), ret.date().isoformat()))
-        current += timedelta(days=1)
-
-    return pairs
+    return list(zip(starts[mask].strftime("%Y-%m-%d"), rets[mask].strftime("%Y-%m-%d")))
@@ -1,19 +1,33 @@
 # report.py
 from __future__ import annotations
 
-import json
-import re
+import heapq
+import os
+import sys
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
+# same module name as the Streamlit app (app/ on sys.path): a single utilitario.jsonio
+sys.path.insert(0, str(Path(__file__).resolve().parent / "app"))
+from utilitario.jsonio import iter_lines_reversed, json_loads  # noqa: E402
+
 DATA_DIR = Path("data")
 STATE_PATH = DATA_DIR / "state.json"
 HISTORY_PATH = DATA_DIR / "history.jsonl"
 SUMMARY_PATH = DATA_DIR / "summary.md"
 
 # New no-hash keys look like: GRU-FCO|dep=...|ret<=2026-10-05|...
-KEEP_REGEX = re.compile(r"^GRU-(FCO|CIA)\|.*\|ret<=2026-10-05\|.*$")
+# Kept keys: ^GRU-(FCO|CIA)\|.*\|ret<=2026-10-05\|  — checked with plain str ops
+KEEP_PREFIXES = ("GRU-FCO|", "GRU-CIA|")
+KEEP_RET_MARK = "|ret<=2026-10-05|"
+
+
+def _keep(key: str) -> bool:
+    # the return mark must come after the prefix (both prefixes are 8 chars)
+    return key.startswith(KEEP_PREFIXES) and key.find(KEEP_RET_MARK, 8) != -1
 
 # Minimal IATA -> Airline name mapping (extend as new codes show up)
 IATA_AIRLINE_NAMES = {
@@ -38,28 +52,39 @@ IATA_AIRLINE_NAMES = {
 def _read_json(path: Path) -> Dict[str, Any]:
     if not path.exists():
         return {}
-    return json.loads(path.read_text(encoding="utf-8"))
+    return json_loads(path.read_bytes())
 
 
 def _read_history_last(n: int = 2) -> List[Dict[str, Any]]:
     if not HISTORY_PATH.exists():
         return []
-    lines = HISTORY_PATH.read_text(encoding="utf-8").splitlines()
-    tail = lines[-n:] if len(lines) >= n else lines
+    # history.jsonl is append-only: read blocks from the end until the last n
+    # non-empty lines are found, without loading the rest of the file
+    tail: List[bytes] = []
+    for line in iter_lines_reversed(HISTORY_PATH):
+        if line.strip():
+            tail.append(line)
+            if len(tail) == n:
+                break
+    tail.reverse()
     out: List[Dict[str, Any]] = []
     for line in tail:
-        line = line.strip()
-        if not line:
-            continue
         try:
-            out.append(json.loads(line))
+            out.append(json_loads(line))
         except Exception:
             pass
     return out
 
 
-def _fmt_money(price: float, currency: str) -> str:
-    if price == float("inf"):
+def _to_float(v: Any) -> Optional[float]:
+    try:
+        return float(v)
+    except Exception:
+        return None
+
+
+def _fmt_money(price: Optional[float], currency: str) -> str:
+    if price is None or price == float("inf"):
         return "N/A"
     return f"{currency} {price:,.2f}"
 
@@ -68,14 +93,17 @@ def _md_table_escape(s: str) -> str:
     return (s or "").replace("|", "\\|").replace("\n", " ")
 
 
+@lru_cache(maxsize=256)
 def _airline_label(code: str) -> str:
+    # IATA_AIRLINE_NAMES is static: each code is formatted only once
     code = (code or "").strip().upper()
     name = IATA_AIRLINE_NAMES.get(code)
     return f"{code} ({name})" if name else code
 
 
-def _extract_best_from_results(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-    best: Dict[str, Dict[str, Any]] = {}
+def _extract_best_from_results(results: List[Dict[str, Any]]) -> Dict[str, Tuple[float, Dict[str, Any]]]:
+    # keep (parsed price, row) so the current best is not re-parsed on every row
+    best: Dict[str, Tuple[float, Dict[str, Any]]] = {}
     for r in results or []:
         key = r.get("key")
         price = r.get("price")
@@ -85,8 +113,9 @@ def _extract_best_from_results(results: List[Dict[str, Any]]) -> Dict[str, Dict[
             p = float(price)
         except Exception:
             continue
-        if key not in best or p < float(best[key].get("price", float("inf"))):
-            best[key] = r
+        cur = best.get(key)
+        if cur is None or p < cur[0]:
+            best[key] = (p, r)
     return best
 
 
@@ -107,23 +136,29 @@ def _infer_destination(r: Dict[str, Any]) -> str:
     return "ROM"
 
 
-def _pick_best_rome(curr_results: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
-    candidates: List[Tuple[float, Dict[str, Any]]] = []
-    for r in curr_results or []:
+def _scan_rome(
+    results: List[Dict[str, Any]],
+) -> Tuple[Optional[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Single pass over the results (destination inferred once per row):
+    - best Rome (FCO/CIA) result by lowest price (ties: the first one)
+    - first result of each destination, for the per-destination tables
+    """
+    best: Optional[Dict[str, Any]] = None
+    best_p = float("inf")
+    first_by_dest: Dict[str, Dict[str, Any]] = {}
+    for r in results or []:
         dest = _infer_destination(r)
         if dest not in ("FCO", "CIA"):
             continue
+        first_by_dest.setdefault(dest, r)
         try:
             p = float(r.get("price", float("inf")))
         except Exception:
             p = float("inf")
-        candidates.append((p, r))
-
-    if not candidates:
-        return None
-
-    candidates.sort(key=lambda x: x[0])
-    return candidates[0][1]
+        if best is None or p < best_p:
+            best, best_p = r, p
+    return best, first_by_dest
 
 
 def _render_carrier_table(md: List[str], by_carrier: Any, currency: str) -> None:
@@ -131,40 +166,24 @@ def _render_carrier_table(md: List[str], by_carrier: Any, currency: str) -> None
         md.append("_No airline split available for this run._")
         return
 
-    rows: List[Tuple[str, float]] = []
-    for c, v in by_carrier.items():
-        try:
-            p = float(v)
-        except Exception:
-            continue
-        rows.append((str(c), p))
-
+    rows = [(str(c), p) for c, p in ((c, _to_float(v)) for c, v in by_carrier.items()) if p is not None]
     if not rows:
         md.append("_No airline split available for this run._")
         return
 
-    rows.sort(key=lambda x: x[1])
-
     md.append("| Airline | Best Price |")
     md.append("|---|---:|")
-    for c, p in rows[:5]:
+    # top 5 only: partial selection instead of sorting every airline
+    for c, p in heapq.nsmallest(5, rows, key=itemgetter(1)):
         md.append(f"| `{_md_table_escape(_airline_label(c))}` | {_fmt_money(p, currency)} |")
 
 
-def _find_result_for_dest(results: List[Dict[str, Any]], dest: str) -> Optional[Dict[str, Any]]:
-    dest = dest.upper().strip()
-    for r in results or []:
-        if _infer_destination(r) == dest:
-            return r
-    return None
-
-
 def main() -> int:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
     state = _read_json(STATE_PATH)
     best_map: Dict[str, Any] = state.get("best", {}) if isinstance(state.get("best", {}), dict) else {}
-    best_map = {k: v for k, v in best_map.items() if KEEP_REGEX.match(k)}
+    best_map = {k: v for k, v in best_map.items() if _keep(k)}
 
     history = _read_history_last(2)
     curr_run = history[-1] if len(history) >= 1 else None
@@ -173,8 +192,8 @@ def main() -> int:
     curr_results = curr_run.get("results", []) if curr_run else []
     prev_results = prev_run.get("results", []) if prev_run else []
 
-    curr_results_filtered = [r for r in curr_results if KEEP_REGEX.match(str(r.get("key", "")))]
-    prev_results_filtered = [r for r in prev_results if KEEP_REGEX.match(str(r.get("key", "")))]
+    curr_results_filtered = [r for r in curr_results if _keep(str(r.get("key", "")))]
+    prev_results_filtered = [r for r in prev_results if _keep(str(r.get("key", "")))]
 
     curr_best = _extract_best_from_results(curr_results_filtered)
     prev_best = _extract_best_from_results(prev_results_filtered)
@@ -194,7 +213,7 @@ def main() -> int:
     # Headline — best overall Rome
     md.append("## Headline — São Paulo → Roma (FCO/CIA)")
     md.append("")
-    best_rome = _pick_best_rome(curr_results_filtered)
+    best_rome, rome_by_dest = _scan_rome(curr_results_filtered)
     if not best_rome:
         md.append("_No Rome results found in latest run._")
         md.append("")
@@ -225,7 +244,7 @@ def main() -> int:
     md.append("## Per Destination — Airline Split")
     md.append("")
     for dest in ("FCO", "CIA"):
-        r = _find_result_for_dest(curr_results_filtered, dest)
+        r = rome_by_dest.get(dest)
         md.append(f"### {dest} — by Airline (Top 5)")
         md.append("")
         if not r:
@@ -257,10 +276,7 @@ def main() -> int:
         md.append("| Route Key | Best Price | Notes |")
         md.append("|---|---:|---|")
         for key, info in best_map.items():
-            try:
-                price = float(info.get("price", float("inf")))
-            except Exception:
-                price = float("inf")
+            price = _to_float(info.get("price"))
             currency = str(info.get("currency", "") or "")
             summary = str(info.get("summary", "") or "")
             md.append(
@@ -276,10 +292,9 @@ def main() -> int:
     else:
         md.append("| Route Key | This Run Best | Change vs Prev |")
         md.append("|---|---:|---:|")
-        for key, r in curr_best.items():
+        for key, (p_now, r) in curr_best.items():
             currency = str(r.get("currency", "") or "")
-            p_now = float(r.get("price", float("inf")))
-            p_prev = float(prev_best.get(key, {}).get("price", float("inf"))) if prev_best else float("inf")
+            p_prev = prev_best[key][0] if key in prev_best else float("inf")
 
             if p_prev == float("inf") or p_now == float("inf"):
                 delta = "N/A"
@@ -290,7 +305,10 @@ def main() -> int:
             md.append(f"| `{_md_table_escape(key)}` | {_fmt_money(p_now, currency)} | {delta} |")
 
     md.append("")
-    SUMMARY_PATH.write_text("\n".join(md) + "\n", encoding="utf-8")
+    # .tmp + os.replace: readers never see a half-written summary
+    tmp = SUMMARY_PATH.with_suffix(".tmp")
+    tmp.write_bytes(("\n".join(md) + "\n").encode("utf-8"))
+    os.replace(tmp, SUMMARY_PATH)
     print(f"Wrote {SUMMARY_PATH}")
     return 0
 
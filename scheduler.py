@@ -87,10 +87,11 @@ def read_json(path: Path, default: Any) -> Any:
     try:
         if not path.exists():
             return default
-        txt = path.read_text(encoding="utf-8").strip()
-        if not txt:
+        raw = path.read_bytes().strip()
+        if not raw:
             return default
-        return json.loads(txt)
+        # json.loads aceita bytes (detecta UTF-8): evita o decode intermediário em str
+        return json.loads(raw)
     except Exception:
         return default
 
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# o app roda com app/ no sys.path (imports como utilitario.*)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from utilitario import analytics  # noqa: E402
+from utilitario.history_store import get_store  # noqa: E402
+
+
+@pytest.fixture
+def store_name(tmp_path, monkeypatch):
+    # DATA_DIR é relativo ("data"): o store do teste vive no tmp_path
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    name = f"t_{tmp_path.name}"
+    store = get_store(name)
+    for i, t in enumerate(("a", "b", "a", "c", "b")):
+        store.append(t, {"i": i})
+    return name
+
+
+@pytest.mark.parametrize("empty", [[], "", [""]])
+def test_empty_event_types_means_no_filter(store_name, empty):
+    assert analytics._types_set(empty) is None
+    assert len(analytics.query_events_for_table(store_name, event_types=empty)) == 5
+    assert len(analytics.query_events_columnar(store_name, event_types=empty)["type"]) == 5
+    assert len(analytics.load_events(get_store(store_name), event_types=empty)) == 5
+
+
+def test_event_types_filter(store_name):
+    df = analytics.query_events_for_table(store_name, event_types="a")
+    assert df["i"].tolist() == [0, 2]
+    rows = analytics.load_events(get_store(store_name), event_types=["b", ""])
+    assert [r.payload["i"] for r in rows] == [1, 4]